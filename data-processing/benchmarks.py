@@ -0,0 +1,696 @@
+""" Benchmarks of the data processing pipeline
+
+Simply run:
+python3 benchmarks.py <benchmark name>
+
+Available benchmarks are listed in BENCHMARKS.
+"""
+
+import glob
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pymupdf
+from bs4 import BeautifulSoup
+from PyPDF2 import PdfReader, PdfMerger
+
+from langchain.text_splitter import MarkdownTextSplitter
+
+from chunk_dedup import DedupIndex, _shingle_hashes
+from chunk_embeddings import EmbeddingStore, get_embedder
+from chunk_quality import QUALITY_BATCH_SIZE, SCORES, QualityFilter, score_chunks
+from chunk_tokens import TokenCounter
+from data_extraction import MARKDOWN_PAGES_PER_TASK, Extractor, markdown_headers
+from extraction_cache import ExtractionCache
+from vector_index import IVF_MIN_TRAIN_SIZE, VectorIndex
+from webscraper import add_metadata_to_pdf, parse_DTM_listing
+
+
+EXAMPLE_PDF = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "pdf_examples", "example1.pdf")
+
+
+def _timeit(function, *args, repeat=5):
+    """
+    Returns the best wall time of `repeat` calls to `function`, in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _memory_status(field):
+    # Resident memory counters of the process, in KB (Linux only)
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+def _measure_peak_memory(queue, function, args):
+    # Resets the peak resident memory (VmHWM) to the current one
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+    before = _memory_status("VmRSS")
+    function(*args)
+    queue.put(_memory_status("VmHWM") - before)
+
+
+def _peak_memory(function, *args):
+    """
+    Returns the increase of the peak resident memory, in KB, caused by
+    a call to `function`, measured in a fresh process so that memory
+    allocated by C libraries is accounted for (Linux only).
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure_peak_memory, args=(queue, function, args))
+    process.start()
+    peak = queue.get()
+    process.join()
+    return peak
+
+
+def _add_metadata_to_pdf_merger(filename, metadata):
+    # Former implementation of `add_metadata_to_pdf`, kept as a baseline
+    file_in = open(filename, 'ab+')
+    pdf_reader = PdfReader(file_in)
+    old_metadata = pdf_reader.metadata
+
+    pdf_merger = PdfMerger()
+    pdf_merger.append(file_in)
+    pdf_merger.add_metadata(dict(old_metadata, **metadata))
+    pdf_merger.write(file_in)
+
+    file_in.close()
+
+
+def bench_add_metadata(pdf_path=EXAMPLE_PDF, repeat=5):
+    """
+    Compares bytes written and time per report when stamping metadata
+    with PdfMerger and with an incremental update.
+    """
+    metadata = {
+        '/Title': 'Report_Somalia_0',
+        '/Country': 'Somalia',
+        '/Year': '2024'
+    }
+    implementations = {
+        'PdfMerger rewrite': _add_metadata_to_pdf_merger,
+        'incremental update': add_metadata_to_pdf
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{os.path.basename(pdf_path)}: {os.path.getsize(pdf_path)} bytes")
+        for name, implementation in implementations.items():
+            durations = []
+            written = []
+            for i in range(repeat):
+                file_path = os.path.join(tmp_dir, f"report_{i}.pdf")
+                shutil.copy(pdf_path, file_path)
+                size = os.path.getsize(file_path)
+
+                durations.append(_timeit(implementation, file_path, metadata, repeat=1))
+                written.append(os.path.getsize(file_path) - size)
+
+            print(f"{name:>20}: {min(durations)*1000:8.1f} ms/report, "
+                  f"{max(written):>9} bytes written/report")
+
+
+def _parse_DTM_listing_bs4(content):
+    # Former implementation of `parse_DTM_listing`, kept as a baseline
+    soup = BeautifulSoup ( content , "html.parser" )
+
+    all_reports = soup.find_all('span',
+                          attrs={
+                              'class' :"file file--mime-application-pdf file--application-pdf"
+                             }
+                          )
+
+    return [report.a.attrs['href'] for report in all_reports]
+
+
+def _synthetic_listing_page(page, nb_reports=20, nb_menu_items=400):
+    """
+    Builds an HTML page shaped like a DTM reports listing: a large
+    navigation and facet block, then the results with their PDF links.
+    """
+    menu = "".join(f'<li class="menu-item"><a href="/node/{i}" class="menu-link">'
+                   f'Menu entry {i}</a><ul><li><a href="/node/{i}/sub">Sub</a></li></ul></li>'
+                   for i in range(nb_menu_items))
+    results = "".join(
+        f'<div class="views-row"><article class="report"><h3><a href="/reports/{page}-{i}">'
+        f'Displacement report {page}-{i}</a></h3><div class="field--name-body"><p>'
+        + "Summary of the displacement situation. " * 30 +
+        '</p></div><time datetime="2024-06-06T12:00:00Z">06 June 2024</time>'
+        '<span class="file file--mime-application-pdf file--application-pdf">'
+        f'<a href="/sites/default/files/reports/report_{page}_{i}.pdf">Download</a></span>'
+        '</article></div>'
+        for i in range(nb_reports))
+    return (f'<!DOCTYPE html><html><head><title>Reports</title></head><body>'
+            f'<nav><ul>{menu}</ul></nav><main>{results}</main></body></html>').encode("utf-8")
+
+
+def _parse_pages(parser, pages):
+    for content in pages:
+        parser(content)
+
+
+def _load_listing_pages(pages_dir=None, nb_pages=50):
+    if pages_dir is None:
+        return [_synthetic_listing_page(page) for page in range(nb_pages)]
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+        with open(path, "rb") as file:
+            pages.append(file.read())
+    return pages
+
+
+def _parse_listing_pages(parser_name, pages_dir):
+    _parse_pages(LISTING_PARSERS[parser_name], _load_listing_pages(pages_dir))
+
+
+LISTING_PARSERS = {
+    'BeautifulSoup html.parser': _parse_DTM_listing_bs4,
+    'lxml selective': parse_DTM_listing
+}
+
+
+def bench_listing_parse(pages_dir=None, repeat=5):
+    """
+    Compares parse time and peak memory of the listing extraction
+    on saved listing pages (*.html in `pages_dir`), or on synthetic
+    DTM-like pages if no directory is given.
+    """
+    pages = _load_listing_pages(pages_dir)
+    size = sum(len(content) for content in pages)
+    print(f"{len(pages)} listing pages, {size/len(pages)/1000:.0f} KB/page")
+
+    baseline = _peak_memory(_load_listing_pages, pages_dir)
+    for name, parser in LISTING_PARSERS.items():
+        assert parser(pages[0]) == _parse_DTM_listing_bs4(pages[0])
+        duration = _timeit(_parse_pages, parser, pages, repeat=repeat)
+        peak = _peak_memory(_parse_listing_pages, name, pages_dir) - baseline
+        print(f"{name:>26}: {duration/len(pages)*1000:7.2f} ms/page, "
+              f"{max(peak, 0)/1000:7.1f} MB peak memory")
+
+
+def _read_pdf_twice(filename):
+    # Former ingestion: PyPDF2 for the metadata, then PyMuPDF for the text
+    metadata = dict(PdfReader(filename).metadata)
+    doc = pymupdf.open(filename)
+    pages = [page.get_text() for page in doc]
+    metadata['/PageCount'] = len(doc)
+    return pages, metadata
+
+
+def _read_pdf_once(filename):
+    content = Extractor().ingest_pdf(filename)
+    return content['pages'], dict(content['metadata'], **{'/PageCount': content['page_count']})
+
+
+PDF_READERS = {
+    'PyPDF2 + PyMuPDF': _read_pdf_twice,
+    'single PyMuPDF open': _read_pdf_once
+}
+
+
+def _synthetic_report(file_path, nb_pages=30, lines_per_page=45, running_headers=False):
+    """
+    Writes a text-only PDF shaped like a DTM report, stamped with
+    the metadata added by the crawler, optionally with a running header
+    and footer on every page.
+    """
+    doc = pymupdf.open()
+    for page_number in range(nb_pages):
+        page = doc.new_page()
+        text = "\n".join(f"Site {page_number}-{line}: 1,250 individuals displaced "
+                         "by floods, 320 households in need of shelter."
+                         for line in range(lines_per_page))
+        if running_headers:
+            text = (f"SOMALIA - FLASH UPDATE #{nb_pages}\nInternational Organization for Migration\n"
+                    f"{text}\nPage {page_number + 1} of {nb_pages}")
+        page.insert_text((40, 40), text, fontsize=8)
+    doc.set_metadata({'creationDate': "D:20240606151944+03'00'", 'title': 'Report'})
+    doc.save(file_path)
+    doc.close()
+    add_metadata_to_pdf(file_path, {'/Country': 'Somalia', '/Year': '2024'})
+
+
+def _read_pdfs(reader_name, pdf_paths):
+    for pdf_path in pdf_paths:
+        PDF_READERS[reader_name](pdf_path)
+
+
+def bench_pdf_ingestion(pdf_path=EXAMPLE_PDF, nb_reports=20, repeat=3):
+    """
+    Compares time and peak memory of reading the text and metadata of
+    a report with two parsers and with a single PyMuPDF open, on the
+    example report and on a synthetic corpus.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = []
+        for i_report in range(nb_reports):
+            corpus.append(os.path.join(tmp_dir, f"report_{i_report}.pdf"))
+            _synthetic_report(corpus[-1])
+
+        for label, pdf_paths in ((os.path.basename(pdf_path), [pdf_path]),
+                                 (f"{nb_reports} synthetic reports", corpus)):
+            print(label)
+            pages, metadata = _read_pdf_twice(pdf_paths[0])
+            for name in PDF_READERS:
+                assert PDF_READERS[name](pdf_paths[0]) == (pages, metadata)
+                duration = _timeit(_read_pdfs, name, pdf_paths, repeat=repeat)
+                peak = _peak_memory(_read_pdfs, name, pdf_paths)
+                print(f"{name:>26}: {duration/len(pdf_paths)*1000:7.1f} ms/report, "
+                      f"{max(peak, 0)/1000:7.1f} MB peak memory")
+
+
+def _select_alpha_chunks_loop(chunks):
+    # Former chunk selection, kept as a baseline
+    return [chunk for chunk in chunks
+            if sum([x.isalpha() for x in chunk])/len(chunk) >= 0.7]
+
+
+def _select_chunks_filter(chunks, thresholds=None):
+    return list(QualityFilter(thresholds).filter(chunks))
+
+
+def _score_chunks(chunks, names):
+    for start in range(0, len(chunks), QUALITY_BATCH_SIZE):
+        score_chunks(chunks[start:start + QUALITY_BATCH_SIZE], names)
+
+
+def _example_chunks(pdf_path=EXAMPLE_PDF, chunk_size=512):
+    extractor = Extractor()
+    return list(extractor.split_text(extractor.ingest_pdf(pdf_path)['pages'], chunk_size))
+
+
+def bench_chunk_quality(pdf_path=EXAMPLE_PDF, nb_copies=100, repeat=3):
+    """
+    Compares the time to select the chunks of a large report with the
+    per-character alpha ratio loop and with the batched quality filter,
+    on the chunks of the example report repeated `nb_copies` times.
+
+    The loop only computes the alpha ratio, so only 'filter, alpha only'
+    does the same work: the time of every score on its own follows, to
+    show what the other thresholds cost.
+    """
+    chunks = _example_chunks(pdf_path) * nb_copies
+    print(f"{len(chunks)} chunks, {sum(map(len, chunks))/1e6:.1f} M characters")
+
+    all_scores = {'alpha': (0.7, None), 'digit': (None, 0.3), 'whitespace': (None, 0.3),
+                  'table_line': (None, 0.5), 'repetition': (None, 0.5)}
+    assert _select_chunks_filter(chunks) == _select_alpha_chunks_loop(chunks)
+    implementations = {
+        'alpha ratio loop': (_select_alpha_chunks_loop, chunks),
+        'filter, alpha only': (_select_chunks_filter, chunks),
+        'filter, all scores': (_select_chunks_filter, chunks, all_scores),
+    }
+    implementations.update({f"score {name}": (_score_chunks, chunks, (name,)) for name in SCORES})
+    for name, (function, *args) in implementations.items():
+        duration = _timeit(function, *args, repeat=repeat)
+        print(f"{name:>20}: {duration*1000:8.1f} ms, "
+              f"{duration/len(chunks)*1e6:6.1f} us/chunk")
+
+    quality_filter = QualityFilter(all_scores)
+    list(quality_filter.filter(chunks[:len(chunks)//nb_copies]))
+    print(f"Drop statistics on {os.path.basename(pdf_path)}: {quality_filter.stats}")
+
+
+def _split_pages(pages, chunk_size, length_function):
+    splitter = MarkdownTextSplitter(chunk_size=chunk_size, chunk_overlap=0,
+                                    length_function=length_function)
+    return splitter.split_text("".join(pages))
+
+
+def _split_tokens(pages, chunk_size, backend, cache_size):
+    # A new counter every time, so that memoized counts do not carry over
+    counter = TokenCounter(backend, cache_size=cache_size)
+    return _split_pages(pages, chunk_size, counter)
+
+
+def bench_token_chunking(pdf_path=EXAMPLE_PDF, chunk_size=512, repeat=3):
+    """
+    Compares chunks per report, tokens per chunk and splitting throughput
+    when chunk sizes are counted in characters and in tokens, with the
+    Mistral tokenizer (if installed) and its local approximation.
+    """
+    pages = Extractor().ingest_pdf(pdf_path)['pages']
+    nb_chars = sum(map(len, pages))
+    try:
+        reference = TokenCounter('mistral')
+    except ImportError:
+        reference = TokenCounter('approximate')
+    print(f"{os.path.basename(pdf_path)}: {nb_chars} characters, "
+          f"{reference(''.join(pages))} tokens ({reference.name}), chunk_size={chunk_size}")
+
+    modes = {'characters': (_split_pages, pages, chunk_size, len)}
+    for backend in ('approximate', 'mistral'):
+        if backend == 'mistral' and reference.name == 'approximate':
+            continue
+        modes[f"tokens ({backend})"] = (_split_tokens, pages, chunk_size, backend, None)
+        modes[f"tokens ({backend}, no memo)"] = (_split_tokens, pages, chunk_size, backend, 0)
+
+    for name, (function, *args) in modes.items():
+        chunks = function(*args)
+        tokens = [reference(chunk) for chunk in chunks]
+        duration = _timeit(function, *args, repeat=repeat)
+        print(f"{name:>28}: {len(chunks):4} chunks/report, "
+              f"{sum(tokens)/len(tokens):6.1f} tokens/chunk (max {max(tokens)}), "
+              f"{nb_chars/duration/1e6:6.2f} M characters/s")
+
+
+def _split_text_file_whole(file_path):
+    # Former splitting: the whole text file and all its documents in memory
+    splitter = MarkdownTextSplitter(chunk_size=512, chunk_overlap=0)
+    with open(file_path, "r", encoding='utf-8') as text_file:
+        docs = splitter.create_documents([text_file.read()])
+    for doc in docs:
+        doc.page_content
+
+
+def _split_text_file_streaming(file_path):
+    with open(file_path, "r", encoding='utf-8') as text_file:
+        for chunk in Extractor().split_text(iter(lambda: text_file.read(1 << 16), "")):
+            pass
+
+
+def bench_streaming_split(pdf_path=EXAMPLE_PDF, sizes=(1, 10, 50, 200)):
+    """
+    Compares the peak memory and time of splitting the text of reports
+    of growing size (the example report repeated) loaded at once and
+    streamed by windows.
+    """
+    text = "".join(Extractor().ingest_pdf(pdf_path)['pages'])
+    implementations = {
+        'whole text': _split_text_file_whole,
+        'streaming windows': _split_text_file_streaming,
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            file_path = os.path.join(tmp_dir, f"report_{size}.txt")
+            with open(file_path, "w", encoding='utf-8') as text_file:
+                for _ in range(size):
+                    text_file.write(text)
+            print(f"{os.path.getsize(file_path)/1e6:.2f} MB of text")
+            for name, function in implementations.items():
+                duration = _timeit(function, file_path, repeat=1)
+                peak = _peak_memory(function, file_path)
+                print(f"{name:>20}: {duration*1000:8.1f} ms, {max(peak, 0)/1000:7.1f} MB peak memory")
+
+
+def _extract_corpus(backend, pdf_paths):
+    extractor = Extractor()
+    return [extractor.ingest_pdf(pdf_path, backend=backend)['pages'] for pdf_path in pdf_paths]
+
+
+def _extract_corpus_parallel(backend, pdf_paths, workers):
+    # Page ranges of all the reports in parallel, as in Extractor.pdf_to_chunks
+    extractor = Extractor()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for pdf_path in pdf_paths:
+            with pymupdf.open(pdf_path) as doc:
+                headers = markdown_headers(doc)
+                starts = range(0, doc.page_count, MARKDOWN_PAGES_PER_TASK)
+            futures.append([executor.submit(extractor.extract_pages, pdf_path, start,
+                                            start + MARKDOWN_PAGES_PER_TASK, backend, headers)
+                            for start in starts])
+        return [[text for future in ranges for text in future.result()] for ranges in futures]
+
+
+def _read_cached_corpus(cache, extractor, nb_reports):
+    return [cache.pages(str(i_report), extractor) for i_report in range(nb_reports)]
+
+
+def bench_extraction_backends(pdf_path=EXAMPLE_PDF, nb_reports=3, workers=(2, 4)):
+    """
+    Compares the throughput, in pages per second, of the plain text and
+    Markdown extraction backends on the example report and a few synthetic
+    reports: Markdown in a single process, by page ranges in parallel
+    processes, and read back from the extraction cache.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = [pdf_path]
+        for i_report in range(nb_reports):
+            corpus.append(os.path.join(tmp_dir, f"report_{i_report}.pdf"))
+            _synthetic_report(corpus[-1], nb_pages=10)
+        nb_pages = 0
+        for path in corpus:
+            with pymupdf.open(path) as doc:
+                nb_pages += doc.page_count
+        print(f"{len(corpus)} reports, {nb_pages} pages")
+
+        def report(name, duration):
+            print(f"{name:>30}: {nb_pages/duration:8.1f} pages/s")
+
+        report('text', _timeit(_extract_corpus, 'text', corpus, repeat=3))
+        start = time.perf_counter()
+        pages = _extract_corpus('markdown', corpus)
+        report('markdown', time.perf_counter() - start)
+        for nb_workers in workers:
+            start = time.perf_counter()
+            assert _extract_corpus_parallel('markdown', corpus, nb_workers) == pages
+            report(f"markdown, {nb_workers} processes", time.perf_counter() - start)
+
+        cache = ExtractionCache(os.path.join(tmp_dir, "extraction_cache.sqlite"))
+        for i_report, report_pages in enumerate(pages):
+            cache.put_pages(str(i_report), 'markdown', report_pages)
+        report('markdown, cached',
+               _timeit(_read_cached_corpus, cache, 'markdown', len(corpus), repeat=3))
+        cache.close()
+
+
+def _clean_reports(reports):
+    extractor = Extractor()
+    return [list(extractor.clean_text(pages)) for pages in reports]
+
+
+def _count_chunks(reports):
+    # Number of chunks of the reports, and of chunks kept by the quality filter
+    extractor = Extractor()
+    chunks = [chunk for pages in reports for chunk in extractor.split_text(pages)]
+    return len(chunks), sum(1 for _ in extractor.select_chunks(chunks))
+
+
+def bench_text_cleaning(pdf_path=EXAMPLE_PDF, nb_reports=10, repeat=3):
+    """
+    Measures the throughput of the cleaning of the pages and how much it
+    shrinks the text and the number of chunks, on the example report and on
+    synthetic reports with a running header and footer.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = []
+        for i_report in range(nb_reports):
+            corpus.append(os.path.join(tmp_dir, f"report_{i_report}.pdf"))
+            _synthetic_report(corpus[-1], running_headers=True)
+
+        extractor = Extractor()
+        for label, pdf_paths in ((os.path.basename(pdf_path), [pdf_path]),
+                                 (f"{nb_reports} synthetic reports", corpus)):
+            reports = [extractor.ingest_pdf(path)['pages'] for path in pdf_paths]
+            cleaned = _clean_reports(reports)
+            nb_chars = sum(len(text) for pages in reports for text in pages)
+            nb_cleaned_chars = sum(len(text) for pages in cleaned for text in pages)
+            duration = _timeit(_clean_reports, reports, repeat=repeat)
+            print(f"{label}: cleaned at {nb_chars/duration/1e6:.1f} M characters/s")
+            print(f"{'characters':>14}: {nb_chars:8d} -> {nb_cleaned_chars:8d}")
+            for name, before, after in zip(('chunks', 'chunks kept'),
+                                           _count_chunks(reports), _count_chunks(cleaned)):
+                print(f"{name:>14}: {before:8d} -> {after:8d}")
+
+
+def _successive_reports(chunks, nb_reports, repeat_ratio=0.6, edit_ratio=0.03, seed=0):
+    """
+    Returns the chunks of reports following each other, made out of the
+    chunks of a report: each repeats some of them with a few words edited,
+    the others are replaced by new text (the same words shuffled).
+    """
+    generator = random.Random(seed)
+    reports = []
+    for _ in range(nb_reports):
+        report = []
+        for chunk in chunks:
+            words = chunk.split(" ")
+            if generator.random() < repeat_ratio:
+                for i_word in range(len(words)):
+                    if generator.random() < edit_ratio:
+                        words[i_word] = str(generator.randrange(10000))
+            else:
+                generator.shuffle(words)
+            report.append(" ".join(words))
+        reports.append(report)
+    return reports
+
+
+def _index_reports(path, reports):
+    index = DedupIndex(path)
+    for i_report, chunks in enumerate(reports):
+        index.add_report(str(i_report), [f"{i_report}_{i_chunk}" for i_chunk in range(len(chunks))],
+                         chunks)
+    return index
+
+
+def _exact_duplicates(chunks, threshold):
+    # Chunks whose shingles are similar enough to the ones of a previous chunk,
+    # compared to all of them
+    shingles = [set(_shingle_hashes(chunk).tolist()) for chunk in chunks]
+    duplicates = set()
+    for i_chunk, chunk_shingles in enumerate(shingles):
+        for previous in shingles[:i_chunk]:
+            union = len(chunk_shingles | previous)
+            if union and len(chunk_shingles & previous) / union >= threshold:
+                duplicates.add(i_chunk)
+                break
+    return duplicates
+
+
+def bench_chunk_dedup(pdf_path=EXAMPLE_PDF, nb_reports=10, threshold=0.8):
+    """
+    Measures the indexing throughput of the near-duplicate index and its
+    recall and precision against exact all-pairs Jaccard similarities,
+    on successive synthetic reports made out of the chunks of the example report.
+    """
+    reports = _successive_reports(_example_chunks(pdf_path), nb_reports)
+    chunks = [chunk for report in reports for chunk in report]
+    print(f"{nb_reports} reports, {len(chunks)} chunks")
+
+    start = time.perf_counter()
+    truth = _exact_duplicates(chunks, threshold)
+    print(f"{'all pairs':>10}: {len(chunks)/(time.perf_counter() - start):8.0f} chunks/s, "
+          f"{len(truth)} near-duplicates")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        index = _index_reports(os.path.join(tmp_dir, "dedup_index.sqlite"), reports)
+        duration = time.perf_counter() - start
+        ids = [f"{i_report}_{i_chunk}" for i_report, report in enumerate(reports)
+               for i_chunk in range(len(report))]
+        found = {i_chunk for i_chunk, chunk_id in enumerate(ids)
+                 if index.canonical_id(chunk_id) != chunk_id}
+        index.close()
+    print(f"{'MinHash LSH':>10}: {len(chunks)/duration:8.0f} chunks/s, {len(found)} near-duplicates, "
+          f"recall {len(found & truth)/max(len(truth), 1):.3f}, "
+          f"precision {len(found & truth)/max(len(found), 1):.3f}")
+
+
+def bench_embedding(pdf_path=EXAMPLE_PDF, nb_copies=20, batch_sizes=(1, 8, 32, 128),
+                    backend='auto'):
+    """
+    Measures the throughput of the embedding of chunks at several batch sizes,
+    into an empty embedding cache, then from the cache.
+    Copies of the chunks of the example report are numbered so that their
+    contents differ.
+    """
+    chunks = [f"{i_copy} {chunk}" for i_copy in range(nb_copies)
+              for chunk in _example_chunks(pdf_path)]
+    embedder = get_embedder(backend)
+    print(f"{len(chunks)} chunks embedded by {embedder.name}")
+    for batch_size in batch_sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = EmbeddingStore(tmp_dir, embedder)
+            start = time.perf_counter()
+            store.embed(chunks, batch_size)
+            duration = time.perf_counter() - start
+            cached_duration = _timeit(store.embed, chunks, batch_size, repeat=3)
+            store.close()
+        print(f"batch of {batch_size:>4}: {len(chunks)/duration:8.0f} chunks/s, "
+              f"{len(chunks)/cached_duration:8.0f} chunks/s cached")
+
+
+def _clustered_vectors(nb_vectors, dim, nb_clusters, generator, spread=0.5):
+    # Unit vectors around random centers, like embeddings of topics
+    centers = generator.normal(size=(nb_clusters, dim))
+    vectors = centers[generator.integers(0, nb_clusters, nb_vectors)]
+    vectors = vectors + spread * generator.normal(size=(nb_vectors, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _recall(results, truth):
+    found = [len({chunk_id for chunk_id, _ in result} & {chunk_id for chunk_id, _ in expected})
+             for result, expected in zip(results, truth)]
+    return sum(found) / max(sum(len(expected) for expected in truth), 1)
+
+
+def bench_vector_index(nb_vectors=50000, dim=384, nb_queries=100, k=10,
+                       nprobes=(1, 2, 4, 8, 16, 32, 64)):
+    """
+    Compares the recall@k and the latency of the exact and IVF backends of
+    the vector index on clustered synthetic embeddings, without and with a
+    pre-filter on country and year.
+
+    The clusters overlap and the queries are drawn from the same distribution
+    without being indexed, so that searching few lists misses neighbours.
+    Filters leaving no more than IVF_MIN_TRAIN_SIZE chunks are searched
+    exactly by the IVF backend too.
+    """
+    generator = np.random.default_rng(0)
+    vectors = _clustered_vectors(nb_vectors + nb_queries, dim, 100, generator, spread=3.0)
+    vectors, queries = vectors[:nb_vectors], vectors[nb_vectors:]
+    country_codes = generator.integers(0, 20, nb_vectors)
+    countries = [f"country_{i}" for i in country_codes]
+    years = generator.integers(2019, 2025, nb_vectors)
+    chunk_ids = [f"chunk_{i}" for i in range(nb_vectors)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = VectorIndex(tmp_dir, dim, backend='ivf')
+        start = time.perf_counter()
+        index.add(chunk_ids, vectors, countries, years.tolist())
+        print(f"{nb_vectors} vectors of {dim} dimensions indexed in "
+              f"{time.perf_counter() - start:.1f} s, {len(index.centroids)} lists")
+        exact = VectorIndex(tmp_dir, dim, backend='exact')
+
+        for label, filters, nb_filtered in (
+                ('no filter', {}, nb_vectors),
+                ('5 countries', {'country': [f"country_{i}" for i in range(5)]},
+                 np.count_nonzero(country_codes < 5)),
+                ('year', {'year': 2023}, np.count_nonzero(years == 2023)),
+                ('country and year', {'country': 'country_3', 'year': 2023},
+                 np.count_nonzero((country_codes == 3) & (years == 2023)))):
+            path = "ivf" if nb_filtered > IVF_MIN_TRAIN_SIZE else "exact fallback"
+            print(f"{label}: {nb_filtered} chunks, {path}")
+            start = time.perf_counter()
+            truth = exact.search(queries, k, **filters)
+            latency = (time.perf_counter() - start) / nb_queries
+            print(f"{'exact':>13}: recall {1:.3f}, {latency*1000:7.2f} ms/query")
+            for nprobe in nprobes:
+                start = time.perf_counter()
+                results = index.search(queries, k, nprobe=nprobe, **filters)
+                latency = (time.perf_counter() - start) / nb_queries
+                print(f"{f'ivf, {nprobe} lists':>13}: recall {_recall(results, truth):.3f}, "
+                      f"{latency*1000:7.2f} ms/query")
+        exact.close()
+        index.close()
+
+
+BENCHMARKS = {
+    'add_metadata': bench_add_metadata,
+    'listing_parse': bench_listing_parse,
+    'pdf_ingestion': bench_pdf_ingestion,
+    'chunk_quality': bench_chunk_quality,
+    'token_chunking': bench_token_chunking,
+    'streaming_split': bench_streaming_split,
+    'extraction_backends': bench_extraction_backends,
+    'text_cleaning': bench_text_cleaning,
+    'chunk_dedup': bench_chunk_dedup,
+    'embedding': bench_embedding,
+    'vector_index': bench_vector_index,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or BENCHMARKS.keys()
+    for name in names:
+        print(f"--- {name} ---")
+        BENCHMARKS[name]()
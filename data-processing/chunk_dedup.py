@@ -0,0 +1,286 @@
+""" Chunk deduplication
+Collapses the near-duplicate chunks of the corpus: successive reports of a
+country repeat whole paragraphs of methodology and context, which retrieval
+would otherwise return many times.
+
+Chunks are compared through MinHash signatures of their word shingles, and
+LSH banding finds the chunks sharing a band of their signature, so that a new
+chunk is only compared to a few candidates. The index is a SQLite database
+saved next to the chunks and updated report by report: every chunk is mapped
+to a canonical chunk, the first of its near-duplicates, whose provenance is
+the list of the reports of all its duplicates.
+"""
+
+import functools
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+import pyarrow as pa
+
+
+DEDUP_INDEX_FILENAME = "dedup_index.sqlite"
+DEDUP_BATCH_SIZE = 256
+
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: chunks sharing 70% of their shingles are
+# candidates with a probability of 0.5, 80% of them with 0.9
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+# Minimum estimated Jaccard similarity of the shingles of near-duplicate chunks
+DEDUP_THRESHOLD = 0.8
+# Number of words of a shingle
+SHINGLE_WORDS = 3
+WORD_PATTERN = re.compile(r"\w+")
+# Signature of a chunk without any word, never a duplicate
+EMPTY_HASH = np.uint32(0xFFFFFFFF)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    sha256 TEXT PRIMARY KEY,
+    nb_chunks INTEGER,
+    nb_duplicates INTEGER
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    sha256 TEXT,
+    canonical_id TEXT,
+    signature BLOB
+);
+CREATE INDEX IF NOT EXISTS chunks_sha256 ON chunks (sha256);
+CREATE INDEX IF NOT EXISTS chunks_canonical_id ON chunks (canonical_id);
+CREATE TABLE IF NOT EXISTS buckets (
+    key INTEGER,
+    chunk_id TEXT
+);
+CREATE INDEX IF NOT EXISTS buckets_key ON buckets (key);
+CREATE INDEX IF NOT EXISTS buckets_chunk_id ON buckets (chunk_id);
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_parameters():
+    # Random odd multipliers and offsets of the permutations, of the words
+    # of a shingle and of the rows of every band, the same in every run
+    generator = np.random.default_rng(0)
+    def odd(*shape):
+        return generator.integers(0, 2**63, size=shape, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    offsets = generator.integers(0, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+    return odd(NUM_PERMUTATIONS), offsets, odd(SHINGLE_WORDS), odd(BANDS, ROWS)
+
+
+def _shingle_hashes(text):
+    # 64-bit hashes of the shingles of consecutive words of a text
+    words = WORD_PATTERN.findall(text.lower())
+    word_hashes = np.fromiter((zlib.crc32(word.encode("utf8")) for word in words),
+                              dtype=np.uint64, count=len(words))
+    _, _, word_weights, _ = _hash_parameters()
+    nb_shingles = max(len(words) - SHINGLE_WORDS + 1, min(len(words), 1))
+    hashes = np.zeros(nb_shingles, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i_word, weight in enumerate(word_weights[:len(words)]):
+            hashes += word_hashes[i_word:i_word + nb_shingles] * weight
+    return hashes
+
+
+def minhash_signatures(texts):
+    """
+    Returns the MinHash signatures of a batch of texts, as an array of
+    shape (len(texts), NUM_PERMUTATIONS) of uint32. Texts without any word
+    have a signature of EMPTY_HASH only.
+    """
+    multipliers, offsets, _, _ = _hash_parameters()
+    shingles = [_shingle_hashes(text) for text in texts]
+    counts = np.array([len(hashes) for hashes in shingles], dtype=np.int64)
+    signatures = np.full((len(texts), NUM_PERMUTATIONS), EMPTY_HASH, dtype=np.uint32)
+    if counts.sum() == 0:
+        return signatures
+
+    # Universal hashes (a * x + b) mod 2^64 of all the shingles at once, keeping the high bits
+    with np.errstate(over='ignore'):
+        hashes = np.concatenate(shingles)[:, None] * multipliers + offsets
+    hashes = (hashes >> np.uint64(32)).astype(np.uint32)
+    starts = np.cumsum(counts) - counts
+    non_empty = counts > 0
+    signatures[non_empty] = np.minimum.reduceat(hashes, starts[non_empty], axis=0)
+    return signatures
+
+
+def band_keys(signatures):
+    """
+    Returns the LSH bucket keys of signatures, one per band, as int64.
+    Keys of different bands differ, so that all bands share a single table.
+    """
+    _, _, _, band_weights = _hash_parameters()
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    with np.errstate(over='ignore'):
+        keys = (bands * band_weights).sum(axis=2, dtype=np.uint64)
+    return keys.view(np.int64)
+
+
+class DedupIndex():
+    """
+    Persistent LSH index of the chunks of the corpus.
+
+    - reports: reports indexed, with their number of chunks and of near-duplicates
+    - chunks: signature of every chunk and the id of its canonical chunk
+    - buckets: LSH bucket keys of the canonical chunks
+
+    Example:
+        index = DedupIndex("dtm_chunks/dedup_index.sqlite")
+        index.add_report(sha256, chunk_ids, texts)
+        table = index.deduplicate(ChunkStore("dtm_chunks").load())
+    """
+
+    def __init__(self, path, threshold=DEDUP_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def has(self, sha256):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT 1 FROM reports WHERE sha256 = ?", (sha256,)).fetchone() is not None
+
+    def _insert_buckets(self, chunk_id, signature):
+        if signature[0] == EMPTY_HASH:
+            return
+        self.connection.executemany(
+            "INSERT INTO buckets (key, chunk_id) VALUES (?, ?)",
+            [(int(key), chunk_id) for key in band_keys(signature[None])[0]])
+
+    def _find_canonical(self, signature, keys):
+        # Canonical chunk most similar to the signature among the candidates, or None
+        if signature[0] == EMPTY_HASH:
+            return None
+        candidates = self.connection.execute(
+            f"""SELECT DISTINCT chunks.chunk_id, chunks.signature FROM buckets
+            JOIN chunks ON chunks.chunk_id = buckets.chunk_id
+            WHERE buckets.key IN ({', '.join('?' * len(keys))})""",
+            [int(key) for key in keys]).fetchall()
+        best_id, best_similarity = None, self.threshold
+        for chunk_id, candidate in candidates:
+            similarity = np.mean(np.frombuffer(candidate, dtype=np.uint32) == signature)
+            if similarity >= best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        return best_id
+
+    def _remove(self, sha256):
+        # Canonical chunks of the report that stand for chunks of other reports
+        orphans = self.connection.execute(
+            """SELECT chunk_id, canonical_id, signature FROM chunks
+            WHERE sha256 != ? AND canonical_id IN (SELECT chunk_id FROM chunks WHERE sha256 = ?)
+            ORDER BY chunk_id""", (sha256, sha256)).fetchall()
+        self.connection.execute(
+            "DELETE FROM buckets WHERE chunk_id IN (SELECT chunk_id FROM chunks WHERE sha256 = ?)",
+            (sha256,))
+        self.connection.execute("DELETE FROM chunks WHERE sha256 = ?", (sha256,))
+        self.connection.execute("DELETE FROM reports WHERE sha256 = ?", (sha256,))
+
+        # The first remaining duplicate of every group becomes its canonical chunk
+        promoted = {}
+        for chunk_id, canonical_id, signature in orphans:
+            promoted.setdefault(canonical_id, (chunk_id, signature))
+        for canonical_id, (chunk_id, signature) in promoted.items():
+            self.connection.execute("UPDATE chunks SET canonical_id = ? WHERE canonical_id = ?",
+                                    (chunk_id, canonical_id))
+            self._insert_buckets(chunk_id, np.frombuffer(signature, dtype=np.uint32))
+
+    def add_report(self, sha256, chunk_ids, texts):
+        """
+        Indexes the chunks of a report, replacing its previous chunks if any.
+        Every chunk near-duplicate of a chunk already indexed, of this report
+        or of another one, is mapped to the canonical chunk of the latter.
+
+        Parameters:
+            sha256 (str): hash of the report
+            chunk_ids (list): ids of the chunks
+            texts (list): text of the chunks
+
+        Returns:
+            nb_duplicates (int): number of chunks of the report that are near-duplicates
+        """
+        nb_duplicates = 0
+        with self._lock, self.connection:
+            self._remove(sha256)
+            for start in range(0, len(texts), DEDUP_BATCH_SIZE):
+                signatures = minhash_signatures(texts[start:start + DEDUP_BATCH_SIZE])
+                keys = band_keys(signatures)
+                for chunk_id, signature, chunk_keys in zip(
+                        chunk_ids[start:start + DEDUP_BATCH_SIZE], signatures, keys):
+                    canonical_id = self._find_canonical(signature, chunk_keys)
+                    if canonical_id is None:
+                        canonical_id = chunk_id
+                        self._insert_buckets(chunk_id, signature)
+                    else:
+                        nb_duplicates += 1
+                    self.connection.execute(
+                        """INSERT INTO chunks (chunk_id, sha256, canonical_id, signature)
+                        VALUES (?, ?, ?, ?)""", (chunk_id, sha256, canonical_id, signature.tobytes()))
+            self.connection.execute(
+                "INSERT INTO reports (sha256, nb_chunks, nb_duplicates) VALUES (?, ?, ?)",
+                (sha256, len(chunk_ids), nb_duplicates))
+        return nb_duplicates
+
+    def remove_report(self, sha256):
+        with self._lock, self.connection:
+            self._remove(sha256)
+
+    def canonical_id(self, chunk_id):
+        """
+        Returns the id of the canonical chunk of a chunk, None if it is not indexed.
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT canonical_id FROM chunks WHERE chunk_id = ?", (chunk_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def provenance(self, chunk_id):
+        """
+        Returns the hashes of the reports holding the chunk or a near-duplicate of it.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                """SELECT DISTINCT sha256 FROM chunks WHERE canonical_id =
+                (SELECT canonical_id FROM chunks WHERE chunk_id = ?) ORDER BY sha256""",
+                (chunk_id,)).fetchall()
+        return [sha256 for (sha256,) in rows]
+
+    def deduplicate(self, table):
+        """
+        Keeps the canonical chunks of a table of chunks (see ChunkStore.load),
+        adding their provenance as a 'reports' column: the hashes of the reports
+        of all their near-duplicates. Chunks not indexed are kept as they are.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT chunk_id, canonical_id, sha256 FROM chunks").fetchall()
+        canonical_ids = {}
+        reports = {}
+        for chunk_id, canonical_id, sha256 in rows:
+            canonical_ids[chunk_id] = canonical_id
+            reports.setdefault(canonical_id, set()).add(sha256)
+
+        ids = table.column('id').to_pylist()
+        table = table.filter(pa.array([canonical_ids.get(chunk_id, chunk_id) == chunk_id
+                                       for chunk_id in ids]))
+        provenance = [sorted(reports.get(chunk_id, {chunk_id.rsplit('_', 1)[0]}))
+                      for chunk_id in table.column('id').to_pylist()]
+        return table.append_column('reports', pa.array(provenance, pa.list_(pa.string())))
+
+    def stats(self):
+        """
+        Returns the number of reports, chunks and canonical chunks indexed.
+        """
+        with self._lock:
+            return dict(zip(('reports', 'chunks', 'canonical_chunks'), self.connection.execute(
+                """SELECT (SELECT COUNT(*) FROM reports), COUNT(*),
+                COUNT(DISTINCT canonical_id) FROM chunks""").fetchone()))
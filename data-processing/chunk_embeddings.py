@@ -0,0 +1,261 @@
+""" Chunk embeddings
+Embeds the chunks of the reports for RAG with a local model, by micro-batches,
+and keeps the vectors in an on-disk cache so that a new run only embeds the
+chunks that are new or changed.
+
+The model is a sentence-transformers model when the package is installed,
+otherwise a deterministic hashing embedder, which needs no model and is
+meant for tests and development.
+
+Vectors are rows of a float32 matrix appended to a file and read through
+a memory map, one matrix per embedder; a SQLite table maps the content
+hash of every chunk text to its row.
+"""
+
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+from chunk_store import ChunkStore
+
+
+EMBEDDINGS_FILENAME = "embeddings.sqlite"
+EMBEDDING_BATCH_SIZE = 32
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+HASHING_DIM = 384
+WORD_PATTERN = re.compile(r"\w+")
+# Maximum number of parameters of a SQLite query
+MAX_QUERY_PARAMETERS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matrices (
+    embedder TEXT PRIMARY KEY,
+    dim INTEGER
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    embedder TEXT,
+    key BLOB,
+    row INTEGER,
+    PRIMARY KEY (embedder, key)
+);
+"""
+
+
+def content_key(text):
+    """
+    Returns the content hash of a chunk text, the key of its vector.
+    """
+    return hashlib.blake2b(text.encode("utf8"), digest_size=16).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _feature_weights():
+    # Random odd multipliers of the hashes of the words and of the second word of bigrams
+    generator = np.random.default_rng(0)
+    return generator.integers(0, 2**63, size=2, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+class HashingEmbedder():
+    """
+    Deterministic stand-in for an embedding model: the words and pairs of
+    consecutive words of a text are hashed into `dim` signed features, and
+    the vector is normalized. Texts sharing words have similar vectors.
+    """
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        """
+        Returns the vectors of a batch of texts, as a (len(texts), dim) float32 array
+        of unit norm (zero for texts without words).
+        """
+        word_weight, pair_weight = _feature_weights()
+        features = []
+        for text in texts:
+            words = WORD_PATTERN.findall(text.lower())
+            hashes = np.fromiter((zlib.crc32(word.encode("utf8")) for word in words),
+                                 dtype=np.uint64, count=len(words))
+            with np.errstate(over='ignore'):
+                features.append(np.concatenate([hashes * word_weight,
+                                                hashes[:-1] * word_weight + hashes[1:] * pair_weight]))
+        counts = np.array([len(text_features) for text_features in features], dtype=np.int64)
+        hashes = np.concatenate(features) if features else np.zeros(0, dtype=np.uint64)
+
+        # Feature index from the high bits of the hash, sign from the next bit
+        columns = ((hashes >> np.uint64(32)) % np.uint64(self.dim)).astype(np.int64)
+        signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), 1.0, -1.0)
+        rows = np.repeat(np.arange(len(texts)), counts)
+        vectors = np.bincount(rows * self.dim + columns, weights=signs,
+                              minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class SentenceTransformerEmbedder():
+    """
+    Local sentence-transformers model, run on CPU by default.
+    """
+
+    def __init__(self, model_name=DEFAULT_EMBEDDING_MODEL, device='cpu'):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = model_name
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), batch_size=max(len(texts), 1),
+                                 normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedder(backend='auto', model_name=DEFAULT_EMBEDDING_MODEL):
+    """
+    Returns the embedder of the process for `backend`: 'sentence-transformers',
+    'hashing', or 'auto' for a sentence-transformers model if installed.
+    """
+    if backend == 'hashing':
+        return HashingEmbedder()
+    try:
+        return SentenceTransformerEmbedder(model_name)
+    except ImportError:
+        if backend == 'sentence-transformers':
+            raise ImportError("The embedding model needs sentence-transformers")
+    return HashingEmbedder()
+
+
+class EmbeddingStore():
+    """
+    Cache of the vectors of an embedder, in `embeddings_dir`.
+
+    Example:
+        store = EmbeddingStore("dtm_embeddings", get_embedder())
+        rows = store.embed(texts)
+        vectors = store.matrix()[rows]
+
+    After embedding, `stats` holds the number of texts embedded by the model
+    ('embedded') and found in the cache ('cached').
+    """
+
+    def __init__(self, embeddings_dir, embedder):
+        os.makedirs(embeddings_dir, exist_ok=True)
+        self.embedder = embedder
+        self.matrix_path = os.path.join(embeddings_dir,
+                                        re.sub(r"[^\w.-]", "_", embedder.name) + ".f32")
+        self.stats = {'embedded': 0, 'cached': 0}
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(embeddings_dir, EMBEDDINGS_FILENAME),
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("INSERT OR IGNORE INTO matrices (embedder, dim) VALUES (?, ?)",
+                                    (embedder.name, embedder.dim))
+        dim, = self.connection.execute("SELECT dim FROM matrices WHERE embedder = ?",
+                                       (embedder.name,)).fetchone()
+        if dim != embedder.dim:
+            raise ValueError(f"Vectors of {embedder.name} have {dim} dimensions, not {embedder.dim}")
+
+        self.nb_rows, = self.connection.execute(
+            "SELECT COUNT(*) FROM embeddings WHERE embedder = ?", (embedder.name,)).fetchone()
+        # Vectors appended by an interrupted run after the last recorded row are dropped
+        row_size = embedder.dim * np.dtype(np.float32).itemsize
+        if not os.path.isfile(self.matrix_path):
+            open(self.matrix_path, "wb").close()
+        if os.path.getsize(self.matrix_path) > self.nb_rows * row_size:
+            os.truncate(self.matrix_path, self.nb_rows * row_size)
+
+    def close(self):
+        self.connection.close()
+
+    def rows(self, keys):
+        """
+        Returns the rows of the vectors of content keys, -1 for the keys not embedded yet.
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+                batch = keys[start:start + MAX_QUERY_PARAMETERS]
+                found.update(self.connection.execute(
+                    f"""SELECT key, row FROM embeddings WHERE embedder = ?
+                    AND key IN ({', '.join('?' * len(batch))})""",
+                    [self.embedder.name, *batch]).fetchall())
+        return np.array([found.get(key, -1) for key in keys], dtype=np.int64)
+
+    def _append(self, keys, vectors):
+        # Vectors are written before their rows are recorded
+        with self._lock:
+            with open(self.matrix_path, "ab") as matrix_file:
+                matrix_file.write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO embeddings (embedder, key, row) VALUES (?, ?, ?)",
+                    [(self.embedder.name, key, self.nb_rows + i_key) for i_key, key in enumerate(keys)])
+            self.nb_rows += len(keys)
+
+    def embed(self, texts, batch_size=EMBEDDING_BATCH_SIZE):
+        """
+        Embeds the texts not in the cache yet, by batches of `batch_size`.
+
+        Returns:
+            rows (numpy.ndarray): row of the vector of every text in `matrix()`
+        """
+        keys = [content_key(text) for text in texts]
+        rows = self.rows(keys)
+        # Texts to embed, once per content
+        missing = {}
+        for key, text, row in zip(keys, texts, rows):
+            if row < 0:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), batch_size):
+            batch_keys = missing_keys[start:start + batch_size]
+            self._append(batch_keys, self.embedder.embed([missing[key] for key in batch_keys]))
+
+        self.stats['embedded'] += len(missing)
+        self.stats['cached'] += len(texts) - len(missing)
+        return self.rows(keys) if missing else rows
+
+    def matrix(self):
+        """
+        Returns all the vectors of the embedder, memory-mapped, one row per content.
+        """
+        if self.nb_rows == 0:
+            return np.zeros((0, self.embedder.dim), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype='<f4', mode='r',
+                         shape=(self.nb_rows, self.embedder.dim))
+
+
+def embed_chunks(chunks_dir, embeddings_dir, chunk_format='jsonl', backend='auto',
+                 batch_size=EMBEDDING_BATCH_SIZE, verbose=False):
+    """
+    Embeds the chunks of the chunk store in `chunks_dir`, shard by shard,
+    into the embedding cache in `embeddings_dir`. Chunks already embedded,
+    in this store or another, are not embedded again.
+
+    Returns:
+        stats (dict): number of chunks embedded and found in the cache
+    """
+    chunk_store = ChunkStore(chunks_dir, chunk_format)
+    embedding_store = EmbeddingStore(embeddings_dir, get_embedder(backend))
+    shards = chunk_store.shards()
+    for i_shard, path in enumerate(shards):
+        chunk_prefix = os.path.basename(path)[:-len(chunk_format)-1]
+        texts = chunk_store.read(chunk_prefix, columns=['page_content']).column(0).to_pylist()
+        embedded = embedding_store.stats['embedded']
+        embedding_store.embed(texts, batch_size)
+        if verbose:
+            print(f"({i_shard+1}/{len(shards)}) Embedded {embedding_store.stats['embedded'] - embedded} "
+                  f"new chunks out of {len(texts)} of {chunk_prefix}")
+    if verbose:
+        print(f"Embedded {embedding_store.stats['embedded']} chunks with "
+              f"{embedding_store.embedder.name}, {embedding_store.stats['cached']} were cached")
+    embedding_store.close()
+    return embedding_store.stats
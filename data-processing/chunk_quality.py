@@ -0,0 +1,221 @@
+""" Chunk quality
+Scores the chunks of a report by batches and drops the ones that are
+not worth keeping for RAG (tables flattened into text, lists of figures,
+repeated boilerplate...).
+
+Scores are computed with NumPy over the code points of a whole batch of
+chunks at once, instead of a Python loop over every character.
+"""
+
+import functools
+from itertools import islice
+
+import numpy as np
+
+
+QUALITY_BATCH_SIZE = 256
+
+# Character classes, as bit flags
+ALPHA = 1
+DIGIT = 2
+SPACE = 4
+
+# Minimum ratio of letters of the non-blank characters of a line of text,
+# lines below it are counted as table lines
+TABLE_LINE_ALPHA_RATIO = 0.5
+
+# Bounds (min, max) of the scores of the chunks kept, None for no bound.
+# Scores are ratios in [0, 1], see `score_chunks`
+DEFAULT_THRESHOLDS = {
+    'alpha': (0.7, None),
+}
+
+
+SCORES = ('alpha', 'digit', 'whitespace', 'table_line', 'repetition')
+
+# Odd base of the polynomial hashes of the words, modulo 2^32
+WORD_HASH_BASE = 0x9E3779B1
+# Words are compared on their 32-bit hash, next to the index of their chunk in the batch
+CHUNK_KEY_SHIFT = 32
+
+
+@functools.lru_cache(maxsize=None)
+def _char_classes():
+    # Character classes of the Basic Multilingual Plane, computed once
+    table = np.zeros(0x10000, dtype=np.uint8)
+    for code in range(0x10000):
+        char = chr(code)
+        table[code] = ((ALPHA if char.isalpha() else 0)
+                       | (DIGIT if char.isdigit() else 0)
+                       | (SPACE if char.isspace() else 0))
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def _hash_powers(size):
+    # Powers B^i and B^-i modulo 2^32 of the hash base, for i < size
+    powers = np.full(size, WORD_HASH_BASE, dtype=np.uint32)
+    inverse_powers = np.full(size, pow(WORD_HASH_BASE, -1, 2**32), dtype=np.uint32)
+    powers[0] = inverse_powers[0] = 1
+    return (np.multiply.accumulate(powers, dtype=np.uint32),
+            np.multiply.accumulate(inverse_powers, dtype=np.uint32))
+
+
+def _segment_sums(values, starts, ends):
+    # Sums of `values` over the segments [starts[i], ends[i]), which
+    # must follow each other and cover `values`
+    sums = np.zeros(len(starts), dtype=np.int64)
+    non_empty = ends > starts
+    if non_empty.any():
+        sums[non_empty] = np.add.reduceat(values, starts[non_empty], dtype=np.int64)
+    return sums
+
+
+def _repetition(codes, visible, starts, nb_chunks):
+    # Ratio of the words of every chunk equal to a previous word of the chunk.
+    # Words are hashed as polynomials of their characters over the whole
+    # batch, so that no Python string is created: the hash of a word starting
+    # at i is B * B^-i * sum(c[j] * B^j), with blanks counting as 0 so that
+    # a word can be summed up to the start of the next one
+    if len(codes) == 0:
+        return np.zeros(nb_chunks)
+    is_word_start = np.empty(len(codes), dtype=bool)
+    is_word_start[0] = visible[0]
+    np.greater(visible[1:], visible[:-1], out=is_word_start[1:])
+    chunk_starts = starts[starts < len(codes)]
+    is_word_start[chunk_starts] = visible[chunk_starts]
+    word_starts = np.flatnonzero(is_word_start)
+    if len(word_starts) == 0:
+        return np.zeros(nb_chunks)
+
+    powers, inverse_powers = _hash_powers(1 << len(codes).bit_length())
+    weighted = codes * powers[:len(codes)]
+    np.multiply(weighted, visible, out=weighted)
+    # Times B once more, so that one-letter words do not differ in their low bits only
+    hashes = np.add.reduceat(weighted, word_starts, dtype=np.uint32) \
+        * inverse_powers[word_starts] * np.uint32(WORD_HASH_BASE)
+    nb_words = np.diff(np.searchsorted(word_starts, starts), append=len(word_starts))
+
+    # Distinct (chunk, word) pairs, as keys with the chunk in the high bits
+    keys = np.repeat(np.arange(nb_chunks, dtype=np.uint64) << np.uint64(CHUNK_KEY_SHIFT),
+                     nb_words) | hashes
+    keys.sort()
+    is_new = np.empty(len(keys), dtype=bool)
+    is_new[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=is_new[1:])
+    nb_distinct = np.bincount((keys[is_new] >> np.uint64(CHUNK_KEY_SHIFT)).astype(np.int64),
+                              minlength=nb_chunks)
+    return (nb_words - nb_distinct) / np.maximum(nb_words, 1)
+
+
+def score_chunks(chunks, names=SCORES):
+    """
+    Scores a batch of chunks.
+
+    Parameters:
+        chunks (list): text of the chunks
+        names (iterable): scores to compute, all by default
+
+    Returns:
+        scores (dict): for every score, an array with one value per chunk
+            - alpha: ratio of letters
+            - digit: ratio of digits
+            - whitespace: ratio of whitespace characters
+            - table_line: ratio of the non-blank lines that are mostly not letters
+            - repetition: ratio of the words that repeat a previous word of the chunk
+    """
+    lengths = np.fromiter((len(chunk) for chunk in chunks), dtype=np.int64, count=len(chunks))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    sizes = np.maximum(lengths, 1)
+
+    codes = np.frombuffer("".join(chunks).encode("utf-32-le"), dtype=np.uint32)
+    # Characters out of the BMP count as U+FFFF, which is in no class
+    classes = np.take(_char_classes(), codes, mode='clip')
+    alpha = (classes & ALPHA).astype(bool)
+    space = (classes & SPACE).astype(bool)
+
+    scores = {}
+    if 'alpha' in names:
+        scores['alpha'] = _segment_sums(alpha, starts, ends) / sizes
+    if 'digit' in names:
+        scores['digit'] = _segment_sums((classes & DIGIT).astype(bool), starts, ends) / sizes
+    if 'whitespace' in names:
+        scores['whitespace'] = _segment_sums(space, starts, ends) / sizes
+
+    if 'table_line' in names and len(codes):
+        # Lines: segments between the chunk starts and the characters after a line feed
+        is_line_start = np.zeros(len(codes) + 1, dtype=bool)
+        is_line_start[starts] = True
+        is_line_start[np.flatnonzero(codes == 0x0A) + 1] = True
+        line_starts = np.flatnonzero(is_line_start[:-1])
+        line_lengths = np.diff(line_starts, append=len(codes))
+        line_chunks = np.repeat(np.arange(len(chunks)),
+                                np.diff(np.searchsorted(line_starts, starts), append=len(line_starts)))
+        line_alpha = np.add.reduceat(alpha, line_starts, dtype=np.int64)
+        line_visible = line_lengths - np.add.reduceat(space, line_starts, dtype=np.int64)
+        is_line = line_visible > 0
+        is_table_line = is_line & (line_alpha < TABLE_LINE_ALPHA_RATIO * line_visible)
+        nb_lines = np.bincount(line_chunks, weights=is_line, minlength=len(chunks))
+        nb_table_lines = np.bincount(line_chunks, weights=is_table_line, minlength=len(chunks))
+        scores['table_line'] = nb_table_lines / np.maximum(nb_lines, 1)
+    elif 'table_line' in names:
+        scores['table_line'] = np.zeros(len(chunks))
+
+    if 'repetition' in names:
+        scores['repetition'] = _repetition(codes, ~space, starts, len(chunks))
+
+    return scores
+
+
+class QualityFilter():
+    """
+    Drops the chunks whose scores are out of the thresholds.
+
+    Parameters:
+        thresholds (dict): bounds (min, max) of the scores of the chunks kept,
+            e.g. {'alpha': (0.7, None), 'table_line': (None, 0.5)}
+        scorer (function): returns the scores named in the thresholds
+            for a batch of chunks, `score_chunks` by default
+        batch_size (int): number of chunks scored at once
+
+    After filtering, `stats` holds the number of chunks scored ('chunks'),
+    kept ('kept') and dropped by every score (a chunk can be dropped by several).
+    """
+
+    def __init__(self, thresholds=None, scorer=score_chunks, batch_size=QUALITY_BATCH_SIZE):
+        self.thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.stats = dict({'chunks': 0, 'kept': 0}, **{name: 0 for name in self.thresholds})
+
+    def keep(self, chunks):
+        """
+        Returns a boolean array telling which chunks of a batch to keep.
+        """
+        scores = self.scorer(chunks, self.thresholds.keys())
+        kept = np.ones(len(chunks), dtype=bool)
+        for name, (minimum, maximum) in self.thresholds.items():
+            valid = np.ones(len(chunks), dtype=bool)
+            if minimum is not None:
+                valid &= scores[name] >= minimum
+            if maximum is not None:
+                valid &= scores[name] <= maximum
+            self.stats[name] += int(np.count_nonzero(~valid))
+            kept &= valid
+        self.stats['chunks'] += len(chunks)
+        self.stats['kept'] += int(np.count_nonzero(kept))
+        return kept
+
+    def filter(self, chunks):
+        """
+        Yields the chunks worth keeping, scoring them by batches.
+        """
+        chunks = iter(chunks)
+        while True:
+            batch = list(islice(chunks, self.batch_size))
+            if not batch:
+                return
+            for chunk, kept in zip(batch, self.keep(batch)):
+                if kept:
+                    yield chunk
@@ -0,0 +1,229 @@
+""" Chunk store
+Chunks of the reports, saved in one shard per report instead of one
+JSON file per chunk.
+
+A shard is either:
+- <prefix>.jsonl: one compact JSON line per chunk, with a sidecar
+  <prefix>.jsonl.idx holding the byte offsets of the lines, so that a single
+  chunk is read by id through mmap without parsing the rest of the shard
+- <prefix>.parquet: the same rows as a Parquet table
+
+The metadata of a report is stored as columns of its chunks (see CHUNK_SCHEMA),
+and `load` reads a whole corpus at once as a table of columns.
+"""
+
+import glob
+import json
+import mmap
+import os
+from array import array
+
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+
+
+FORMATS = ('jsonl', 'parquet')
+INDEX_SUFFIX = ".idx"
+
+CHUNK_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('sha256', pa.string()),
+    ('chunk', pa.int32()),
+    ('page_content', pa.string()),
+    ('title', pa.string()),
+    ('country', pa.string()),
+    ('year', pa.int32()),
+    ('published_on', pa.string()),
+    ('names', pa.list_(pa.string())),
+    ('sources', pa.list_(pa.string())),
+])
+
+
+def chunk_id(chunk_prefix, i_chunk):
+    return f"{chunk_prefix}_{i_chunk}"
+
+
+def _year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def metadata_columns(metadata):
+    """
+    Returns the columns of the chunks of a report from its metadata,
+    with the PDF-style keys of the catalog ('/Title', '/Country'...).
+    """
+    return {
+        'sha256': metadata.get('/SHA256'),
+        'title': metadata.get('/Title'),
+        'country': metadata.get('/Country'),
+        'year': _year(metadata.get('/Year')),
+        'published_on': metadata.get('/PublishedOn'),
+        'names': list(metadata.get('/Names', [])),
+        'sources': list(metadata.get('/Sources', [])),
+    }
+
+
+class ChunkStore():
+    """
+    Shards of chunks saved in `chunks_dir`, in the format `chunk_format`
+    ('jsonl' or 'parquet').
+
+    Example:
+        store = ChunkStore("dtm_chunks")
+        store.get("f6052a...53_12")['page_content']
+        table = store.load(columns=['page_content', 'country', 'year'])
+    """
+
+    def __init__(self, chunks_dir, chunk_format='jsonl'):
+        if chunk_format not in FORMATS:
+            raise ValueError(f"Unknown chunk format {chunk_format}, expected one of {FORMATS}")
+        self.chunks_dir = chunks_dir
+        self.chunk_format = chunk_format
+
+    def shard_path(self, chunk_prefix, chunk_format=None):
+        return os.path.join(self.chunks_dir, f"{chunk_prefix}.{chunk_format or self.chunk_format}")
+
+    def has(self, chunk_prefix):
+        """
+        Tells whether the shard is complete: the index of a JSONL shard
+        is written after the shard itself.
+        """
+        path = self.shard_path(chunk_prefix)
+        if self.chunk_format == 'jsonl':
+            path += INDEX_SUFFIX
+        return os.path.isfile(path)
+
+    def write(self, chunk_prefix, chunks, metadata):
+        """
+        Saves the chunks of a report in a shard, written atomically,
+        replacing the previous shard of the report in any format.
+
+        Parameters:
+            chunk_prefix (str): name of the shard, the hash of the report
+            chunks (iterable): text of the chunks, in order
+            metadata (dict): metadata of the report (see `metadata_columns`)
+
+        Returns:
+            nb_chunks (int): number of chunks saved
+        """
+        columns = metadata_columns(metadata)
+        rows = (dict({'id': chunk_id(chunk_prefix, i_chunk), 'chunk': i_chunk,
+                      'page_content': chunk}, **columns)
+                for i_chunk, chunk in enumerate(chunks))
+
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        path = self.shard_path(chunk_prefix)
+        if self.chunk_format == 'jsonl':
+            nb_chunks = self._write_jsonl(path, rows)
+        else:
+            nb_chunks = self._write_parquet(path, rows)
+
+        for chunk_format in FORMATS:
+            if chunk_format != self.chunk_format:
+                self._remove(chunk_prefix, chunk_format)
+        return nb_chunks
+
+    def _write_jsonl(self, path, rows):
+        offsets = array('Q', [0])
+        with open(path + ".tmp", "wb") as file:
+            for row in rows:
+                line = json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n"
+                file.write(line.encode("utf8"))
+                offsets.append(file.tell())
+        with open(path + INDEX_SUFFIX + ".tmp", "wb") as index:
+            offsets.tofile(index)
+        # The index of the previous shard goes first, so that a crash
+        # never leaves the new shard with the offsets of the previous one
+        if os.path.exists(path + INDEX_SUFFIX):
+            os.remove(path + INDEX_SUFFIX)
+        os.replace(path + ".tmp", path)
+        os.replace(path + INDEX_SUFFIX + ".tmp", path + INDEX_SUFFIX)
+        return len(offsets) - 1
+
+    def _write_parquet(self, path, rows):
+        table = pa.Table.from_pylist(list(rows), schema=CHUNK_SCHEMA)
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return table.num_rows
+
+    def _remove(self, chunk_prefix, chunk_format):
+        path = self.shard_path(chunk_prefix, chunk_format)
+        for file_path in (path + INDEX_SUFFIX, path):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    def get(self, chunk_id):
+        """
+        Returns the chunk `chunk_id` ('<prefix>_<index>') as a dict of columns,
+        or None if it does not exist.
+        """
+        chunk_prefix, i_chunk = chunk_id.rsplit('_', 1)
+        i_chunk = int(i_chunk)
+        if not self.has(chunk_prefix):
+            return None
+
+        path = self.shard_path(chunk_prefix)
+        if self.chunk_format == 'parquet':
+            table = pq.read_table(path, memory_map=True)
+            if i_chunk >= table.num_rows:
+                return None
+            return table.slice(i_chunk, 1).to_pylist()[0]
+
+        # Offsets of the line of the chunk and of the next one
+        offsets = array('Q')
+        with open(path + INDEX_SUFFIX, "rb") as index:
+            index.seek(i_chunk * offsets.itemsize)
+            offsets.frombytes(index.read(2 * offsets.itemsize))
+        if len(offsets) < 2:
+            return None
+        with open(path, "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return json.loads(content[offsets[0]:offsets[1]])
+
+    def shards(self):
+        pattern = os.path.join(self.chunks_dir, f"*.{self.chunk_format}")
+        return [path for path in sorted(glob.glob(pattern))
+                if self.has(os.path.basename(path)[:-len(self.chunk_format)-1])]
+
+    def _empty_table(self, columns=None):
+        schema = CHUNK_SCHEMA if columns is None else pa.schema(
+            [CHUNK_SCHEMA.field(column) for column in columns])
+        return schema.empty_table()
+
+    def _read_shard(self, path, columns=None):
+        if self.chunk_format == 'parquet':
+            return pq.read_table(path, columns=columns, memory_map=True)
+        if os.path.getsize(path) == 0:
+            return self._empty_table(columns)
+        options = pa_json.ParseOptions(explicit_schema=CHUNK_SCHEMA)
+        table = pa_json.read_json(path, parse_options=options)
+        return table if columns is None else table.select(columns)
+
+    def read(self, chunk_prefix, columns=None):
+        """
+        Reads the chunks of a single shard as a table (see `load`),
+        or None if the shard does not exist.
+        """
+        if not self.has(chunk_prefix):
+            return None
+        return self._read_shard(self.shard_path(chunk_prefix), columns)
+
+    def load(self, columns=None):
+        """
+        Reads all the chunks of the store as a single table.
+
+        Parameters:
+            columns (list): columns to read (see CHUNK_SCHEMA), all by default
+
+        Returns:
+            table (pyarrow.Table): one row per chunk, `table.to_pandas()`
+                gives a DataFrame
+        """
+        tables = [self._read_shard(path, columns) for path in self.shards()]
+        if not tables:
+            return self._empty_table(columns)
+        return pa.concat_tables(tables)
@@ -0,0 +1,78 @@
+""" Chunk tokens
+Counts the tokens of a text the way the Mistral models do, so that chunks
+can be sized in tokens instead of characters.
+
+The Mistral tokenizer of mistral_common is used when it is installed,
+otherwise a local approximation of it. Counts are memoized, as the text
+splitter measures the same pieces of text many times.
+"""
+
+import functools
+import re
+
+
+TOKEN_COUNT_CACHE_SIZE = 1 << 16
+
+# Pieces of text counted by the approximation: runs of letters, then
+# every digit, line feed, space before a digit and other character,
+# which the Mistral tokenizers mostly encode as single tokens
+TOKEN_PIECES = re.compile(r"[^\W\d_]+|\n| (?=\d)|\S")
+# Average number of letters per token in the words of the reports
+LETTERS_PER_TOKEN = 4
+
+
+def approximate_token_count(text):
+    """
+    Approximates the number of tokens of `text` for a Mistral tokenizer,
+    without loading it.
+    """
+    return sum((len(piece) + LETTERS_PER_TOKEN - 1) // LETTERS_PER_TOKEN
+               for piece in TOKEN_PIECES.findall(text))
+
+
+def _mistral_encoder():
+    # Encoder of the Mistral tokenizer, None if mistral_common is not installed
+    try:
+        from mistral_common.tokens.tokenizers.mistral import MistralTokenizer
+        tokenizer = MistralTokenizer.v3().instruct_tokenizer.tokenizer
+    except ImportError:
+        return None
+    return functools.partial(tokenizer.encode, bos=False, eos=False)
+
+
+class TokenCounter():
+    """
+    Memoized token counter.
+
+    Parameters:
+        backend (str): 'mistral' for the Mistral tokenizer, 'approximate' for
+            the local approximation, 'auto' for the Mistral tokenizer if installed
+        cache_size (int): number of texts whose count is kept
+
+    `name` identifies the tokenizer used, e.g. in the extraction cache settings.
+    """
+
+    def __init__(self, backend='auto', cache_size=TOKEN_COUNT_CACHE_SIZE):
+        encode = None if backend == 'approximate' else _mistral_encoder()
+        if encode is None and backend == 'mistral':
+            raise ImportError("The Mistral tokenizer needs mistral_common[sentencepiece]")
+
+        if encode is None:
+            self.name = 'approximate'
+            count = approximate_token_count
+        else:
+            self.name = 'mistral-v3'
+            count = lambda text: len(encode(text))
+        self.count = functools.lru_cache(maxsize=cache_size)(count)
+
+    def __call__(self, text):
+        return self.count(text)
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(backend='auto'):
+    """
+    Returns the token counter of the process for `backend`,
+    so that its memoized counts are shared by all the reports.
+    """
+    return TokenCounter(backend)
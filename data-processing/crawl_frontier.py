@@ -0,0 +1,207 @@
+""" Crawl frontier
+Persistent queue of the DTM listing pages and reports left to fetch.
+
+The frontier is stored in a SQLite database, so that a crawl interrupted
+by a crash resumes where it stopped instead of starting over.
+"""
+
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+FRONTIER_FILENAME = "frontier.sqlite"
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+# Reports found by a previous crawl, not listed again by the current one yet
+STALE = 'stale'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    country TEXT,
+    code INTEGER,
+    year INTEGER,
+    page INTEGER,
+    state TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    PRIMARY KEY (country, year, page)
+);
+CREATE TABLE IF NOT EXISTS reports (
+    url TEXT PRIMARY KEY,
+    country TEXT,
+    year INTEGER,
+    idx INTEGER,
+    state TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0
+);
+"""
+
+
+class CrawlFrontier():
+    """
+    Queue of the (country, year, page) listings and of the report URLs
+    to fetch.
+
+    - A listing page yielding reports enqueues the next page, so that every
+    page is read until the results run out.
+    - Report URLs are deduplicated: a report listed several times is fetched
+    once, and keeps the index it was given when first discovered.
+
+    The method `run` fetches everything with a pool of workers.
+
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            # Listings of frontiers created before the facet ids were stored
+            columns = [row['name'] for row in
+                       self.connection.execute("PRAGMA table_info(listings)")]
+            if 'code' not in columns:
+                self.connection.execute("ALTER TABLE listings ADD COLUMN code INTEGER")
+            # Tasks running when the previous crawl crashed are fetched again
+            for table in ('listings', 'reports'):
+                self.connection.execute(
+                    f"UPDATE {table} SET state = ? WHERE state = ?", (PENDING, RUNNING))
+
+    def close(self):
+        self.connection.close()
+
+    def has_pending(self):
+        for table in ('listings', 'reports'):
+            row = self.connection.execute(
+                f"SELECT 1 FROM {table} WHERE state = ? LIMIT 1", (PENDING,)).fetchone()
+            if row is not None:
+                return True
+        return False
+
+    def seed(self, countries, years):
+        """
+        Enqueues the first listing page of every (country, year).
+        If the previous crawl is over, a new one is started: listings are
+        read again and known reports are fetched again only if still listed.
+
+        Parameters:
+            countries (dict): {country name: facet id}, the facet id is
+                stored with the listings so that they can be fetched by a
+                later crawl of other countries
+            years (list): publication years
+        """
+        with self.connection:
+            if not self.has_pending():
+                self.connection.execute("DELETE FROM listings")
+                self.connection.execute(
+                    "UPDATE reports SET state = ?, attempts = 0", (STALE,))
+
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO listings (country, code, year, page) VALUES (?, ?, ?, 0)",
+                [(country, code, year) for country, code in countries.items() for year in years])
+
+    def _claim(self, table, limit):
+        rows = self.connection.execute(
+            f"SELECT rowid, * FROM {table} WHERE state = ? ORDER BY rowid LIMIT ?",
+            (PENDING, limit)).fetchall()
+        with self.connection:
+            self.connection.executemany(
+                f"UPDATE {table} SET state = ? WHERE rowid = ?",
+                [(RUNNING, row['rowid']) for row in rows])
+        return [dict(row, kind=table) for row in rows]
+
+    def claim(self, limit):
+        """
+        Marks up to `limit` pending tasks as running and returns them,
+        listings first.
+        """
+        if limit <= 0:
+            return []
+        tasks = self._claim('listings', limit)
+        return tasks + self._claim('reports', limit - len(tasks))
+
+    def complete_listing(self, task, links):
+        """
+        Records the report links found on a listing page, and enqueues
+        the next page if this one was not empty.
+        """
+        with self.connection:
+            for link in links:
+                self._add_report(link, task['country'], task['year'])
+            if links:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO listings (country, code, year, page) VALUES (?, ?, ?, ?)",
+                    (task['country'], task['code'], task['year'], task['page'] + 1))
+            self.connection.execute(
+                "UPDATE listings SET state = ? WHERE rowid = ?", (DONE, task['rowid']))
+
+    def _add_report(self, url, country, year):
+        idx = self.connection.execute(
+            "SELECT COALESCE(MAX(idx) + 1, 0) FROM reports WHERE country = ?",
+            (country,)).fetchone()[0]
+        self.connection.execute(
+            """INSERT INTO reports (url, country, year, idx) VALUES (?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET state = ? WHERE state = ?""",
+            (url, country, year, idx, PENDING, STALE))
+
+    def complete_report(self, task):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE reports SET state = ? WHERE rowid = ?", (DONE, task['rowid']))
+
+    def fail(self, task):
+        """
+        Puts a failed task back in the queue, unless it already failed
+        `max_attempts` times.
+        """
+        state = PENDING if task['attempts'] + 1 < self.max_attempts else FAILED
+        with self.connection:
+            self.connection.execute(
+                f"UPDATE {task['kind']} SET state = ?, attempts = attempts + 1 WHERE rowid = ?",
+                (state, task['rowid']))
+
+    def run(self, fetch_listing, fetch_report, workers=1, verbose=True):
+        """
+        Fetches every pending task with a pool of `workers` threads,
+        until the frontier is empty.
+
+        Parameters:
+            fetch_listing (callable): takes a listing task (country, code,
+                year, page) and returns the report links found on the page
+            fetch_report (callable): takes a report task (url, country,
+                year, idx) and saves the report
+            workers (int): number of tasks fetched concurrently
+            verbose (bool): prints failures
+        """
+        # The database is only accessed from this thread,
+        # workers only do the fetching.
+        workers = max(workers, 1)
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for task in self.claim(workers - len(running)):
+                    fetch = fetch_listing if task['kind'] == 'listings' else fetch_report
+                    running[executor.submit(fetch, task)] = task
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        if verbose:
+                            print(f"Could not fetch {task}: {e}")
+                        self.fail(task)
+                        continue
+
+                    if task['kind'] == 'listings':
+                        self.complete_listing(task, result)
+                    else:
+                        self.complete_report(task)
@@ -6,15 +6,94 @@ The role of the Extractor is to convert a pdf into chunks for RAG.
     - chunk text
 """
 
+import functools
+import multiprocessing
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 
-from PyPDF2 import PdfReader
-        
 import pymupdf
-#import pymupdf4llm
+import pymupdf4llm
 from langchain.text_splitter import MarkdownTextSplitter
 
 import json
+import re
+
+from chunk_dedup import DEDUP_INDEX_FILENAME, DedupIndex
+from chunk_quality import QualityFilter
+from chunk_store import ChunkStore
+from chunk_tokens import get_token_counter
+from extraction_cache import EXTRACTION_CACHE_FILENAME, ExtractionCache
+from report_catalog import CHUNKED
+from report_store import ReportStore
+from table_extraction import TABLE_PAGES_PER_TASK, TableStore, extract_page_tables
+from text_cleaning import CLEANER_VERSION, TextCleaner
+
+
+PAGES_PER_TASK = 32
+# Markdown extraction takes almost a second per page, so its ranges are shorter
+MARKDOWN_PAGES_PER_TASK = 4
+BACKENDS = ('text', 'markdown')
+CHUNK_UNITS = ('characters', 'tokens')
+# Number of characters of text split at once
+SPLIT_WINDOW = 1 << 16
+# Number of characters read at once from a text file
+TEXT_READ_SIZE = 1 << 16
+# Identifies the extraction of every backend in the extraction cache: bump
+# the version whenever a change of the extraction changes the text of the pages
+EXTRACTOR_VERSIONS = {
+    'text': f"pymupdf-{pymupdf.VersionBind}/1",
+    'markdown': f"pymupdf4llm-{pymupdf4llm.version}/1",
+}
+PDF_DATE_PATTERN = re.compile(r"^D:(\d{4})(\d{2})(\d{2})")
+
+
+def _pdf_date(value):
+    # PDF dates look like "D:20240606151944+03'00'"
+    match = PDF_DATE_PATTERN.match(value or "")
+    if match is None:
+        return None
+    return "-".join(match.groups())
+
+
+def _pdf_info(doc):
+    """
+    Returns the Info dictionary of an open PDF with PyPDF2-style keys
+    ('/Title', '/CreationDate'...), including the custom keys added by
+    the crawler such as '/Country' and '/Year'.
+    """
+    kind, value = doc.xref_get_key(-1, "Info")
+    if kind != "xref":
+        return {}
+    xref = int(value.split()[0])
+    return {f"/{key}": doc.xref_get_key(xref, key)[1] for key in doc.xref_get_keys(xref)}
+
+
+def markdown_headers(doc):
+    """
+    Returns the Markdown header ('# ', '## '...) of the font sizes of the
+    titles of an open PDF document. The sizes are found by scanning all
+    the pages, so this is done once per report, not once per page range.
+    """
+    return pymupdf4llm.IdentifyHeaders(doc).header_id
+
+
+def _markdown_header(headers, span, page=None):
+    # Header of a span of text for pymupdf4llm.to_markdown, by font size
+    return headers.get(round(span["size"]), "")
+
+
+def _tee(pages, into):
+    # Passes the pages through while keeping them in the list `into`
+    for text in pages:
+        into.append(text)
+        yield text
+
+
+def _worker_prefix():
+    # Messages of the parallel workers are prefixed with the worker name
+    worker = multiprocessing.current_process().name
+    return "" if worker == "MainProcess" else f"[{worker}] "
+
 
 class Extractor():
     """
@@ -31,53 +110,255 @@ class Extractor():
     def __init__(self):
         pass
 
-    def convert_pdf_to_text(self, filename, text_folder):
+    def iter_pages(self, doc, start=0, stop=None, progress=False, page_stats=None,
+                   backend='text', headers=None):
+        """
+        Yields the text of the pages [start, stop) of an open PDF document,
+        one page at a time.
+
+        Parameters:
+            doc (pymupdf.Document): open PDF document
+            start, stop (int): range of the pages to read, the whole document by default
+            progress (bool): prints the page being read
+            page_stats (list): if given, the number of characters, words
+                and lines of every page read is appended to it
+            backend (str): 'text' for the plain text of PyMuPDF, 'markdown' for
+                the layout-aware Markdown of pymupdf4llm (headers, lists, tables),
+                which splits better but is much slower
+            headers (dict): Markdown headers of the font sizes of the document
+                (see `markdown_headers`), computed from `doc` by default
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown extraction backend {backend}, expected one of {BACKENDS}")
+        if backend == 'markdown':
+            if headers is None:
+                headers = markdown_headers(doc)
+            header_id = functools.partial(_markdown_header, headers)
+
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for page_number in range(start, stop):
+            if progress:
+                print(f"Page {page_number+1}/{doc.page_count}", end="\r")
+            if backend == 'markdown':
+                text = pymupdf4llm.to_markdown(doc, pages=[page_number], hdr_info=header_id)
+            else:
+                text = doc[page_number].get_text()
+            if page_stats is not None:
+                page_stats.append({
+                    'page': page_number,
+                    'chars': len(text),
+                    'words': len(text.split()),
+                    'lines': text.count("\n")
+                })
+            yield text
+
+    def ingest_pdf(self, filename, start=0, stop=None, progress=False,
+                   backend='text', headers=None):
+        """
+        Reads everything the pipeline needs from a PDF file in a single open:
+        text, metadata, page count and statistics of the pages.
+
+        Parameters:
+            filename (str): path of the PDF file
+            start, stop (int): range [start, stop) of the pages to read,
+                the whole document by default
+            progress (bool): prints the page being read
+            backend, headers: extraction backend (see `iter_pages`)
+
+        Returns:
+            content (dict):
+                - pages (list): text of the pages read
+                - metadata (dict): Info dictionary of the PDF (see `_pdf_info`)
+                - page_count (int): number of pages of the document
+                - page_stats (list): for every page read, its number of
+                  characters, words and lines
+        """
+        with pymupdf.open(filename) as doc:
+            page_stats = []
+            pages = list(self.iter_pages(doc, start, stop, progress, page_stats,
+                                         backend, headers))
+            return {
+                'pages': pages,
+                'metadata': _pdf_info(doc),
+                'page_count': doc.page_count,
+                'page_stats': page_stats
+            }
+
+    def extract_pages(self, filename, start, stop, backend='text', headers=None):
+        """
+        Returns the text of the pages [start, stop) of a PDF file.
+        Used to split very large reports between parallel workers, in which case
+        the Markdown `headers` of the whole report are computed beforehand.
+        """
+        return self.ingest_pdf(filename, start, stop, backend=backend, headers=headers)['pages']
+
+    def save_text(self, pages, file_path):
+        """
+        Passes the text of the pages through while saving it in a text file,
+        written atomically once the last page went through.
+        """
+        with open(file_path + ".tmp", "wb") as text_file:
+            for text in pages:
+                text_file.write(text.encode("utf8"))
+                yield text
+        os.replace(file_path + ".tmp", file_path)
+
+    def convert_pdf_to_text(self, filename, text_folder, page_texts=None):
         """
         Converts a PDF file into a text file
 
         Parameters:
             filename (str): path of the PDF file
+            text_folder (str): directory to save the text file into
+            page_texts (list): text of the document already extracted by
+                page ranges (see `extract_pages`), in page order
         
         Returns:
             file_path (str): path of the new txt file
-            metadata (dict): updated metadata of the PDF file
+            metadata (dict): updated metadata of the PDF file, with its number of pages
         """
 
         assert filename.split('.')[-1] == "pdf", f"File {filename} format is not PDF"
         
-        # extract metadata
-        reader = PdfReader(filename)
-        metadata = dict(reader.metadata)
-        
-        # extract text content
-        doc = pymupdf.open(filename)
-        
         text_filename = filename.split('/')[-1].replace('.pdf', '.txt')
         file_path = os.path.join(text_folder, text_filename)
-        
-        # Iterate the document pages and save them in a txt file
-        text_file = open(file_path, "wb")
-        for page_number, page in enumerate(doc):
-            print(f"Page {page_number+1}/{len(doc)}", end="\r")
-            text = page.get_text().encode("utf8")
-            text_file.write(text)
-        text_file.close()
+
+        with pymupdf.open(filename) as doc:
+            metadata = _pdf_info(doc)
+            metadata['/PageCount'] = doc.page_count
+            if page_texts is None:
+                page_texts = self.iter_pages(doc, progress=_worker_prefix() == "")
+            for _ in self.save_text(page_texts, file_path):
+                pass
         
         return file_path, metadata
 
-    def clean_text(self, filename):
+    def clean_text(self, pages, verbose=False):
         """
-        Cleans the text files before chunking.
-        Yet to be implemented, for instance using a small LLM.
+        Cleans the text of the pages before chunking, one page at a time
+        (see TextCleaner): normalizes Unicode and blanks, joins back hyphenated
+        words and removes running headers and footers.
         """
+        cleaner = TextCleaner()
+        yield from cleaner.clean(pages)
+
+        if verbose:
+            stats = cleaner.stats
+            print(f"Cleaning removed {stats['header_lines']} header and footer lines, "
+                  f"{stats['chars'] - stats['cleaned_chars']} characters out of {stats['chars']}")
+
+    def split_text(self, pages, chunk_size=512, chunk_overlap=0, chunk_unit='characters',
+                   window_size=SPLIT_WINDOW):
+        """
+        Splits the text of the pages into chunks, yielded one at a time.
+
+        The text is split by windows of about `window_size` characters, so
+        that memory does not grow with the size of the report. The last chunk
+        of a window may be cut by the end of the window: it is not yielded
+        but split again at the start of the next window, so that chunks
+        still end on Markdown boundaries (headers, paragraphs, lines).
+
+        Parameters:
+            pages (iterable): text of the pages, in order
+            chunk_size (int): maximum length of a chunk
+            chunk_overlap (int): length of the overlap of two consecutive chunks
+            chunk_unit (str): unit of the lengths, 'characters' or 'tokens'
+                of the Mistral tokenizer (see chunk_tokens.TokenCounter)
+            window_size (int): number of characters split at once
+        """
+        if chunk_unit not in CHUNK_UNITS:
+            raise ValueError(f"Unknown chunk unit {chunk_unit}, expected one of {CHUNK_UNITS}")
+        length_function = len if chunk_unit == 'characters' else get_token_counter()
+        splitter = MarkdownTextSplitter(chunk_size=chunk_size,
+                                        chunk_overlap=chunk_overlap,
+                                        length_function=length_function)
+
+        window = []
+        window_length = 0
+        for text in pages:
+            window.append(text)
+            window_length += len(text)
+            if window_length < window_size:
+                continue
+
+            window_text = "".join(window)
+            chunks = splitter.split_text(window_text)
+            # Start of the last chunk in the window, -1 if the splitter altered it
+            last_start = window_text.rfind(chunks[-1]) if chunks else len(window_text)
+            if len(chunks) == 1 and last_start >= 0:
+                # A single chunk so far, wait for more text
+                window = [window_text]
+                continue
+            if last_start < 0:
+                yield from chunks
+                last_start = len(window_text)
+            else:
+                yield from chunks[:-1]
+            window = [window_text[last_start:]]
+            window_length = len(window[0])
+
+        window_text = "".join(window)
+        if window_text:
+            yield from splitter.split_text(window_text)
+
+    def select_chunks(self, chunks, keep_alpha_chunks=True, quality_thresholds=None,
+                      verbose=False):
+        """
+        Yields the chunks worth keeping, scored by batches (see QualityFilter).
+
+        Parameters:
+            chunks (iterable): text of the chunks
+            keep_alpha_chunks (bool): only keeps the chunks whose quality scores
+                are within the thresholds
+            quality_thresholds (dict): bounds of the quality scores of the chunks
+                kept, by default chunks mostly made out of letters
+        """
+        if not keep_alpha_chunks:
+            yield from chunks
+            return
+
+        quality_filter = QualityFilter(quality_thresholds)
+        yield from quality_filter.filter(chunks)
+
+        if verbose:
+            stats = quality_filter.stats
+            dropped = ", ".join(f"{stats[name]} by {name}" for name in quality_filter.thresholds)
+            print(f"We kept {stats['kept']} chunks out of {stats['chunks']} (dropped {dropped})")
+
+    def write_chunks(self, chunks, chunks_dir, metadata, chunk_prefix,
+                     chunk_format='jsonl'):
+        """
+        Saves the chunks as they come in the shard `chunk_prefix`
+        of the chunk store in `chunks_dir` (see ChunkStore).
+
+        Returns:
+            nb_chunks (int): number of chunks saved
+        """
+        return ChunkStore(chunks_dir, chunk_format).write(chunk_prefix, chunks, metadata)
+
+    def text_to_chunks(self, pages, chunks_dir, metadata, chunk_prefix,
+                       chunk_size=512, chunk_overlap=0,
+                       keep_alpha_chunks=True, chunk_format='jsonl',
+                       quality_thresholds=None, chunk_unit='characters', verbose=False):
+        """
+        Streams the text of the pages through splitting and selection
+        into a shard of chunks.
+
+        Returns:
+            nb_chunks (int): number of chunks saved
+        """
+        chunks = self.split_text(pages, chunk_size, chunk_overlap, chunk_unit)
+        chunks = self.select_chunks(chunks, keep_alpha_chunks, quality_thresholds, verbose)
+        return self.write_chunks(chunks, chunks_dir, metadata, chunk_prefix, chunk_format)
 
-        cleaned_text_filename = filename
-        return cleaned_text_filename
-    
     def convert_text_to_chunks(self, filename, chunks_dir,
                                metadata,
                                chunk_size=512, chunk_overlap=0,
                                keep_alpha_chunks=True,
+                               chunk_prefix=None,
+                               chunk_format='jsonl',
+                               quality_thresholds=None,
+                               chunk_unit='characters',
                                verbose=False):
         """
         Converts a text file into multiple chunks.
@@ -86,89 +367,452 @@ class Extractor():
             filename (str): name of the text file
             chunks_dir (str): directory to save the chunks into
             metadata (dict): metadata to add to every chunk
-            chunk_size (int): approximate number of tokens per chunk
-            chunk_overlap (int): number of tokens in two chunks when they overlap 
+            chunk_size (int): maximum length of a chunk, in `chunk_unit`
+            chunk_overlap (int): length of the overlap of two consecutive chunks
             keep_alpha_chunks (bool): indicates whether to keep chunks containing enough text
+            quality_thresholds (dict): bounds of the quality scores of the chunks kept
+                (see chunk_quality.QualityFilter), by default chunks mostly made out of letters
+            chunk_prefix (str): name of the shard of chunks, the name of the text file by default
+            chunk_format (str): format of the shard, 'jsonl' or 'parquet'
+            chunk_unit (str): unit of the lengths, 'characters' or 'tokens'
+                of the Mistral tokenizer (see chunk_tokens.TokenCounter)
         
         """
-        
-        # Load splitter
-        splitter = MarkdownTextSplitter(chunk_size=chunk_size,
-                                        chunk_overlap=chunk_overlap)
+        if chunk_prefix is None:
+            chunk_prefix = filename.split('/')[-1].replace('.txt', '')
 
         with open(filename, "r", encoding='utf-8') as text_file:
-            
-            text_content = text_file.read()
-            docs = splitter.create_documents([text_content])
-            
-            # Select the best chunks
-            # TODO: put it in a separate function
-            text_docs = []
-            for doc in docs:
-                if keep_alpha_chunks:
-                    # We only keep chunks that are mostly made out of text
-                    alpha_ratio = sum([x.isalpha() for x in doc.page_content])/len(doc.page_content)
-                    if alpha_ratio >= 0.7:
-                        text_docs.append(doc)
-                    
-                    if verbose:
-                        print(f"We kept {len(text_docs)} chunks out of {len(docs)}")
-            
-                else:
-                    text_docs.append(doc)
-            
-        # Save chunks in chunks_dir
-        print(f"Saving {filename.split('/')[-1]} in {len(text_docs)} chunks")
-        chunk_prefix = filename.split('/')[-1].replace('.txt', '_chunk')
-        for i_chunk, doc in enumerate(text_docs):
-            chunk_fn = f"{chunk_prefix}_{i_chunk}.json"
-            file_path = os.path.join(chunks_dir, chunk_fn)
-            metadata['/Chunk'] = str(i_chunk)
-        
-            with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(dict({'page_content': doc.page_content},
-                                **metadata), 
-                          file, ensure_ascii=False, indent=4)
+            blocks = iter(lambda: text_file.read(TEXT_READ_SIZE), "")
+            nb_chunks = self.text_to_chunks(blocks, chunks_dir, metadata, chunk_prefix,
+                                            chunk_size, chunk_overlap,
+                                            keep_alpha_chunks, chunk_format,
+                                            quality_thresholds, chunk_unit, verbose)
+        print(f"Saved {filename.split('/')[-1]} in {nb_chunks} chunks")
+
+    def report_to_chunks(self, pdf_filename, chunks_dir, text_folder,
+                         metadata, chunk_prefix, progress="", verbose=False,
+                         page_texts=None, chunk_size=512, chunk_overlap=0,
+                         keep_alpha_chunks=True, chunk_format='jsonl',
+                         quality_thresholds=None, chunk_unit='characters',
+                         keep_pages=False, backend='text', page_source=None):
+        """
+        Converts a single PDF report into chunks. The pages stream from
+        the PDF through cleaning and splitting into the chunk files, the
+        text of the report is never written to disk unless `text_folder` is given.
+
+        Parameters:
+            pdf_filename (str): path of the PDF file
+            chunks_dir (str): directory to save the chunks into
+            text_folder (str): directory to save the extracted text into,
+                for debugging, None not to save it
+            metadata (dict): metadata of the report in the catalog,
+                added over the metadata of the PDF
+            chunk_prefix (str): name of the shard of chunks
+            progress (str): progress message printed in verbose mode
+            page_texts (list): text of the pages of the report already
+                extracted, by page ranges or in a previous run
+            chunk_size, chunk_overlap, keep_alpha_chunks, chunk_format,
+                quality_thresholds, chunk_unit: chunking settings
+                (see `convert_text_to_chunks`)
+            keep_pages (bool): returns the text of the pages, to cache it
+            backend (str): extraction backend, 'text' or 'markdown' (see `iter_pages`)
+            page_source (callable): takes the open document and yields the
+                text of its pages, instead of `iter_pages` (see `_stream_pages`)
+
+        Returns:
+            page_count (int): number of pages of the report
+            published_on (str): publication date found in the PDF, if any
+            nb_chunks (int): number of chunks saved
+            pages (list): text of the pages if `keep_pages`, None otherwise
+        """
+        report_fn = pdf_filename.split('/')[-1]
+        assert report_fn.split('.')[-1] == "pdf", f"File {pdf_filename} format is not PDF"
+        if verbose:
+            print(f"{_worker_prefix()}{progress}Extracting text from {report_fn}")
+
+        with pymupdf.open(pdf_filename) as doc:
+            page_count = doc.page_count
+            pdf_metadata = _pdf_info(doc)
+            published_on = _pdf_date(pdf_metadata.get('/CreationDate'))
+            if published_on is not None:
+                pdf_metadata['/PublishedOn'] = published_on
+            pdf_metadata.update(metadata)
+
+            if page_texts is None and page_source is not None:
+                page_texts = page_source(doc)
+            elif page_texts is None:
+                page_texts = self.iter_pages(doc, progress=_worker_prefix() == "",
+                                             backend=backend)
+            if text_folder is not None:
+                text_path = os.path.join(text_folder, report_fn.replace('.pdf', '.txt'))
+                page_texts = self.save_text(page_texts, text_path)
+            pages = None
+            if keep_pages:
+                pages = []
+                page_texts = _tee(page_texts, pages)
+
+            page_texts = self.clean_text(page_texts, verbose)
+            nb_chunks = self.text_to_chunks(page_texts, chunks_dir,
+                                            pdf_metadata, chunk_prefix,
+                                            chunk_size, chunk_overlap,
+                                            keep_alpha_chunks, chunk_format,
+                                            quality_thresholds, chunk_unit, verbose)
+
+        print(f"{_worker_prefix()}Saved {report_fn} in {nb_chunks} chunks")
+        return page_count, published_on, nb_chunks, pages
+
+    def _stream_pages(self, doc, sha256, pages_per_task, backend,
+                      cached_pages, record_pages):
+        """
+        Yields the text of the pages of an open report by ranges of
+        `pages_per_task` pages: ranges already cached are read from the cache,
+        the others are extracted and cached (`record_pages`) before their pages
+        are yielded, so that an interrupted run only extracts the remaining
+        ranges again.
+        """
+        headers = None
+        for start in range(0, doc.page_count, pages_per_task):
+            texts = cached_pages(sha256, start, start + pages_per_task)
+            if texts is None:
+                if backend == 'markdown' and headers is None:
+                    headers = markdown_headers(doc)
+                texts = list(self.iter_pages(doc, start, start + pages_per_task,
+                                             progress=True, backend=backend,
+                                             headers=headers))
+                record_pages(sha256, start, texts, doc.page_count)
+            yield from texts
+
+    def _parallel_reports_to_chunks(self, tasks, task_args, record, catalog,
+                                    reports_dir, workers, pages_per_task,
+                                    cached_pages, record_pages):
+        """
+        Converts the reports in a pool of processes. Reports longer than
+        `pages_per_task` pages are split into page ranges extracted by
+        different workers, then stitched back in page order and chunked,
+        so that one huge report does not delay the end of the batch.
+        Reports whose pages are cached are chunked right away.
+
+        Page ranges are cached as soon as they are extracted (`record_pages`),
+        and ranges already cached by an interrupted run are not extracted
+        again (`cached_pages`).
+        """
+        def page_count(report_fn, sha256):
+            count = catalog.select(sha256=sha256)[0]['page_count']
+            if count is None:
+                with pymupdf.open(os.path.join(reports_dir, report_fn)) as doc:
+                    count = doc.page_count
+            return count
+
+        # Largest reports first, so that they do not end up last
+        page_counts = {sha256: page_count(report_fn, sha256) for report_fn, sha256 in tasks}
+        order = sorted(range(len(tasks)), key=lambda i_task: -page_counts[tasks[i_task][1]])
+
+        # Catalog accesses stay in this process, workers only convert reports
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            page_texts = {}
+            # Arguments of the reports split into ranges, until they are chunked
+            split_args = {}
+
+            def submit_report(i_task):
+                args, kwargs = split_args.pop(i_task)
+                # The ranges are cached already
+                kwargs['page_texts'] = [text for texts in page_texts.pop(i_task)
+                                        for text in texts]
+                kwargs['keep_pages'] = False
+                future = executor.submit(self.report_to_chunks, *args, **kwargs)
+                running[future] = ('report', i_task, None)
+
+            for i_task in order:
+                report_fn, sha256 = tasks[i_task]
+                nb_pages = page_counts[sha256]
+                if nb_pages <= pages_per_task:
+                    args, kwargs = task_args(i_task, report_fn, sha256)
+                    future = executor.submit(self.report_to_chunks, *args, **kwargs)
+                    running[future] = ('report', i_task, None)
+                    continue
+
+                # The pages of long reports are looked up by ranges
+                args, kwargs = task_args(i_task, report_fn, sha256, cached=False)
+                split_args[i_task] = (args, kwargs)
+                starts = range(0, nb_pages, pages_per_task)
+                page_texts[i_task] = [cached_pages(sha256, start, start + pages_per_task)
+                                      for start in starts]
+                headers = None
+                for i_range, start in enumerate(starts):
+                    if page_texts[i_task][i_range] is not None:
+                        continue
+                    if kwargs['backend'] == 'markdown' and headers is None:
+                        # Same headers for all the ranges of the report
+                        with pymupdf.open(args[0]) as doc:
+                            headers = markdown_headers(doc)
+                    future = executor.submit(self.extract_pages, args[0],
+                                             start, start + pages_per_task,
+                                             kwargs['backend'], headers)
+                    running[future] = ('range', i_task, i_range)
+                if all(texts is not None for texts in page_texts[i_task]):
+                    submit_report(i_task)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, i_task, i_range = running.pop(future)
+                    report_fn, sha256 = tasks[i_task]
+
+                    if kind == 'report':
+                        record(sha256, future.result())
+                        continue
+
+                    page_texts[i_task][i_range] = future.result()
+                    record_pages(sha256, i_range * pages_per_task,
+                                 page_texts[i_task][i_range], page_counts[sha256])
+                    if all(texts is not None for texts in page_texts[i_task]):
+                        submit_report(i_task)
+
+    def _select_reports(self, store, reports_dir, reports, query, is_done, done_message,
+                        verbose=False):
+        """
+        Returns the reports to convert as (name, hash) pairs, one per content.
+
+        Parameters:
+            store (ReportStore): store of the reports in 'reports_dir'
+            reports (list): names of the reports, all the PDFs in 'reports_dir' by default
+            query (dict): selects the reports from the report catalog instead
+            is_done (function): tells from its hash whether a report is already converted
+            done_message (str): printed in verbose mode for the reports already converted
+        """
+        if query is not None:
+            reports = [report['name'] for report in store.catalog.select(**query)]
         
+        reports_paths = os.listdir(reports_dir) if reports is None else reports
+        reports_paths = [path for path in reports_paths if path.split('.')[-1]=='pdf']
+        nb_reports = len(reports_paths)
+
+        tasks = []
+        extracted_hashes = set()
+        for i_report, report_fn in enumerate(sorted(reports_paths)):
+            sha256 = store.hash_of(report_fn)
+            if sha256 in extracted_hashes:
+                if verbose:
+                    print(f"Skipping ({i_report+1}/{nb_reports}) {report_fn}, already extracted")
+                continue
+            extracted_hashes.add(sha256)
+            if is_done(sha256):
+                if verbose:
+                    print(f"Skipping ({i_report+1}/{nb_reports}) {report_fn}, {done_message}")
+                continue
+            tasks.append((report_fn, sha256))
+        return tasks
 
-    def pdf_to_chunks(self, reports_dir, chunks_dir, verbose=False):
+    def pdf_to_chunks(self, reports_dir, chunks_dir, reports=None, query=None,
+                      workers=1, pages_per_task=None, text_folder=None,
+                      chunk_size=512, chunk_overlap=0, keep_alpha_chunks=True,
+                      chunk_format='jsonl', quality_thresholds=None,
+                      chunk_unit='characters', backend='text', dedup=True, verbose=False):
         """
         Goes through 'reports_dir' to convert PDF reports into chunks.
+        Reports with the same content are converted once, and their chunks
+        are saved in a shard named after the SHA-256 of the content (see ChunkStore).
+
+        The text of the pages is cached in 'reports_dir' (see ExtractionCache):
+        reports already chunked into 'chunks_dir' with the same settings are
+        skipped, and reports chunked with other settings are re-chunked from
+        the cached text without parsing the PDF again. Every backend has its
+        own cache, so switching backends re-chunks the reports, and switching
+        back does not extract them again.
+
+        The chunks of every report are then indexed for near-duplicates across
+        the corpus (see DedupIndex), so that `DedupIndex.deduplicate` gives the
+        canonical chunks of the store and the reports they come from. Reports
+        chunked but not indexed yet are indexed from their shard.
 
         Parameters:
             reports_dir (str): directory where the reports are saved
             chunks_dir (str): directory to save the chunks into
+            reports (list): names of the reports to convert, all the PDFs
+                in 'reports_dir' by default
+            query (dict): selects the reports to convert from the report
+                catalog instead, e.g. {'country': 'Somalia', 'year': 2024}
+                (see ReportCatalog.select); reports already chunked with
+                these settings are skipped either way
+            workers (int): number of reports converted in parallel processes
+            pages_per_task (int): number of pages of the ranges the text is
+                cached by; in parallel mode, reports with more pages are split
+                into page ranges extracted by different workers.
+                PAGES_PER_TASK or MARKDOWN_PAGES_PER_TASK by default
+            text_folder (str): directory to save the extracted text of the
+                reports into, for debugging; not saved by default
+            chunk_size, chunk_overlap, keep_alpha_chunks, chunk_format,
+                quality_thresholds, chunk_unit: chunking settings
+                (see `convert_text_to_chunks`)
+            backend (str): extraction backend, 'text' or 'markdown' (see `iter_pages`)
+            dedup (bool): indexes the near-duplicate chunks in 'chunks_dir'
         
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown extraction backend {backend}, expected one of {BACKENDS}")
+        if pages_per_task is None:
+            pages_per_task = MARKDOWN_PAGES_PER_TASK if backend == 'markdown' else PAGES_PER_TASK
+        extractor_version = EXTRACTOR_VERSIONS[backend]
+
         if not os.path.isdir(chunks_dir):
             os.mkdir(chunks_dir)
 
-        text_folder = 'text_files'
-        
-        if not os.path.isdir(text_folder):
+        if text_folder is not None and not os.path.isdir(text_folder):
             os.mkdir(text_folder)
-        
-        reports_paths = os.listdir(reports_dir)
-        reports_paths = [path for path in reports_paths if path.split('.')[-1]=='pdf']
-        nb_reports = len(reports_paths)
-        
-        for i_report, report_fn in enumerate(sorted(reports_paths)):
+
+        store = ReportStore(reports_dir)
+        catalog = store.catalog
+        chunk_store = ChunkStore(chunks_dir, chunk_format)
+        cache = ExtractionCache(os.path.join(reports_dir, EXTRACTION_CACHE_FILENAME))
+        chunks_key = os.path.abspath(chunks_dir)
+        dedup_index = None
+        if dedup:
+            dedup_index = DedupIndex(os.path.join(chunks_dir, DEDUP_INDEX_FILENAME))
+        settings = json.dumps({
+            'extractor': extractor_version,
+            'cleaner': CLEANER_VERSION,
+            'chunk_size': chunk_size,
+            'chunk_overlap': chunk_overlap,
+            'keep_alpha_chunks': keep_alpha_chunks,
+            'quality_thresholds': quality_thresholds,
+            # Token counts depend on the tokenizer available
+            'chunk_unit': chunk_unit if chunk_unit == 'characters'
+            else f"{chunk_unit}:{get_token_counter().name}"
+        }, sort_keys=True)
+
+        def index_report(sha256, nb_chunks):
+            chunks = chunk_store.read(sha256, columns=['id', 'page_content'])
+            nb_duplicates = dedup_index.add_report(sha256, chunks.column('id').to_pylist(),
+                                                   chunks.column('page_content').to_pylist())
             if verbose:
-                print(f"Extracting text from ({i_report+1}/{nb_reports}) {report_fn}")
-            
+                print(f"{nb_duplicates} of the {nb_chunks} chunks of {sha256[:12]} "
+                      "are near-duplicates")
+
+        def is_chunked(sha256):
+            chunking = cache.chunking(sha256, chunks_key)
+            # The chunks may have been deleted since
+            if chunking is None or chunking[0] != settings or not chunk_store.has(sha256):
+                return False
+            if dedup_index is not None and not dedup_index.has(sha256):
+                # Chunked before the index existed, or without it:
+                # indexed from its shard rather than chunked again
+                index_report(sha256, chunking[1])
+            return True
+
+        tasks = self._select_reports(store, reports_dir, reports, query, is_chunked,
+                                     "already chunked with these settings", verbose)
+
+        def task_args(i_task, report_fn, sha256, cached=True):
+            # The cached pages of the report are only looked up if `cached`
+            metadata = dict(catalog.metadata(sha256), **{'/SHA256': sha256})
+            args = (os.path.join(reports_dir, report_fn), chunks_dir, text_folder,
+                    metadata, sha256, f"({i_task+1}/{len(tasks)}) ", verbose)
+            page_texts = cache.pages(sha256, extractor_version) if cached else None
+            kwargs = {
+                'page_texts': page_texts,
+                'chunk_size': chunk_size,
+                'chunk_overlap': chunk_overlap,
+                'keep_alpha_chunks': keep_alpha_chunks,
+                'chunk_format': chunk_format,
+                'quality_thresholds': quality_thresholds,
+                'chunk_unit': chunk_unit,
+                'keep_pages': page_texts is None,
+                'backend': backend
+            }
+            return args, kwargs
+
+        def record(sha256, result):
+            page_count, published_on, nb_chunks, pages = result
+            if pages is not None:
+                cache.put_pages(sha256, extractor_version, pages)
+            if dedup_index is not None:
+                index_report(sha256, nb_chunks)
+            cache.put_chunking(sha256, chunks_key, settings, nb_chunks)
+
+            # The date already in the catalog prevails over the one found in the PDF
+            published_on = catalog.metadata(sha256).get('/PublishedOn', published_on)
+            catalog.update(sha256, state=CHUNKED, page_count=page_count,
+                           published_on=published_on)
+
+        def cached_pages(sha256, start, stop):
+            return cache.pages(sha256, extractor_version, start, stop)
+
+        def record_pages(sha256, start, pages, page_count):
+            cache.put_pages(sha256, extractor_version, pages, start, page_count)
+
+        if workers <= 1:
+            for i_task, (report_fn, sha256) in enumerate(tasks):
+                args, kwargs = task_args(i_task, report_fn, sha256)
+                if kwargs['page_texts'] is None:
+                    # Pages are cached by ranges as they are extracted,
+                    # from the document opened by report_to_chunks
+                    kwargs['page_source'] = functools.partial(
+                        self._stream_pages, sha256=sha256, pages_per_task=pages_per_task,
+                        backend=backend, cached_pages=cached_pages, record_pages=record_pages)
+                    kwargs['keep_pages'] = False
+                record(sha256, self.report_to_chunks(*args, **kwargs))
+        else:
+            self._parallel_reports_to_chunks(tasks, task_args, record, catalog,
+                                             reports_dir, workers, pages_per_task,
+                                             cached_pages, record_pages)
+
+        if dedup_index is not None:
+            dedup_index.close()
+        cache.close()
+        store.close()
+
+    def pdf_to_tables(self, reports_dir, tables_dir, reports=None, query=None,
+                      workers=1, pages_per_task=TABLE_PAGES_PER_TASK, verbose=False):
+        """
+        Goes through 'reports_dir' to extract the tables of the PDF reports
+        into the table store in 'tables_dir' (see TableStore). Reports whose
+        tables are already stored are skipped.
+
+        Table detection takes about half a second per page, so the pages
+        of all the reports are processed by ranges in parallel processes.
+
+        Parameters:
+            reports_dir (str): directory where the reports are saved
+            tables_dir (str): directory to save the tables into
+            reports, query: reports to process (see `pdf_to_chunks`)
+            workers (int): number of page ranges processed in parallel processes
+            pages_per_task (int): number of pages of a range
+        """
+        store = ReportStore(reports_dir)
+        table_store = TableStore(tables_dir)
+        tasks = self._select_reports(store, reports_dir, reports, query, table_store.has,
+                                     "tables already extracted", verbose)
+
+        # Page ranges of every report; a report without pages still gets its table file
+        ranges = []
+        columns = {}
+        for i_task, (report_fn, sha256) in enumerate(tasks):
             pdf_filename = os.path.join(reports_dir, report_fn)
-            
-            file_path, metadata = self.convert_pdf_to_text(pdf_filename, text_folder)
-         
-        #texts_paths = os.listdir(text_folder)
-        #texts_paths = [path for path in texts_paths if path.split('.')[-1]=='txt']
-
-        #for text_filename in texts_paths:
-            #file_path = os.path.join(text_folder, text_filename)
-            
-            cleaned_text_filename = self.clean_text(file_path)
-            
-            # TODO: what is this metadata lmao
-            self.convert_text_to_chunks(cleaned_text_filename, chunks_dir, metadata)  
-        
+            with pymupdf.open(pdf_filename) as doc:
+                starts = list(range(0, doc.page_count, pages_per_task)) or [0]
+            ranges.extend((i_task, i_range, pdf_filename, start)
+                          for i_range, start in enumerate(starts))
+            columns[i_task] = [None] * len(starts)
+
+        def record(i_task, i_range, result):
+            columns[i_task][i_range] = result
+            if all(part is not None for part in columns[i_task]):
+                report_fn, sha256 = tasks[i_task]
+                nb_tables = table_store.write(sha256, columns.pop(i_task))
+                if verbose:
+                    print(f"({i_task+1}/{len(tasks)}) Saved {nb_tables} tables of {report_fn}")
+
+        if workers <= 1:
+            for i_task, i_range, pdf_filename, start in ranges:
+                record(i_task, i_range,
+                       extract_page_tables(pdf_filename, start, start + pages_per_task))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(extract_page_tables, pdf_filename,
+                                           start, start + pages_per_task): (i_task, i_range)
+                           for i_task, i_range, pdf_filename, start in ranges}
+                for future in as_completed(futures):
+                    record(*futures[future], future.result())
 
+        store.close()
@@ -0,0 +1,201 @@
+""" DTM country index
+Maps country names to the facet ids used to filter the DTM reports listing.
+
+The facets are scraped once from the DTM reports page and persisted,
+then refreshed when older than the TTL; the index on disk is kept if the
+refresh fails. Countries are resolved through the ISO 3166 names of the
+dashboard, and an alias table of the names DTM uses instead, so any country
+selected there can be looked up without a network round-trip.
+"""
+
+import json
+import os
+import re
+import time
+from functools import lru_cache
+from urllib.parse import unquote
+
+import requests
+from bs4 import BeautifulSoup
+from pydtm import utils
+
+
+COUNTRY_INDEX_FILENAME = "dtm_countries.json"
+COUNTRY_INDEX_TTL = 604800  # refreshed after 1 week
+DTM_REPORTS_URL = "https://dtm.iom.int/reports"
+
+FACET_PATTERN = re.compile(r"report_country:(\d+)")
+COUNT_PATTERN = re.compile(r"\s*\(\d+\)\s*$")
+# Punctuation and blanks, ignored when comparing country names
+NAME_SEPARATORS = re.compile(r"[\W_]+")
+
+# ISO 3166-1 alpha-3 codes of the names used by DTM or the UN
+# that differ from the names of the dashboard
+COUNTRY_ALIASES = {
+    "cabo verde": "CPV",
+    "czechia": "CZE",
+    "democratic people s republic of korea": "PRK",
+    "democratic republic of the congo": "COD",
+    "dr congo": "COD",
+    "eswatini": "SWZ",
+    "iran": "IRN",
+    "lao pdr": "LAO",
+    "micronesia": "FSM",
+    "moldova": "MDA",
+    "north macedonia": "MKD",
+    "occupied palestinian territory": "PSE",
+    "palestine": "PSE",
+    "republic of korea": "KOR",
+    "republic of moldova": "MDA",
+    "republic of the congo": "COG",
+    "state of palestine": "PSE",
+    "syria": "SYR",
+    "tanzania": "TZA",
+    "the gambia": "GMB",
+    "turkiye": "TUR",
+    "türkiye": "TUR",
+    "united republic of tanzania": "TZA",
+}
+
+
+@lru_cache(maxsize=1)
+def _iso3_by_name():
+    # Same ISO 3166 table as the country selector of the dashboard
+    ISO3166 = utils.load_ISO3166_data()
+    iso3 = {_name_key(name): str(code).strip().strip('"')
+            for name, code in zip(ISO3166['    "Country"'], ISO3166['Alpha-3 code'])}
+    iso3.update(COUNTRY_ALIASES)
+    return iso3
+
+
+def _name_key(name):
+    # The dashboard passes names formatted as '    "Somalia"', DTM adds
+    # punctuation ("Iran (Islamic Republic of)", "Kosovo*")
+    return NAME_SEPARATORS.sub(" ", str(name).casefold()).strip()
+
+
+def country_code(name):
+    """
+    Returns the ISO 3166-1 alpha-3 code of a country name, or None
+    if it is neither an ISO 3166 name nor a known alias.
+    """
+    return _iso3_by_name().get(_name_key(name))
+
+
+def normalise_country(name):
+    """
+    Returns the ISO 3166-1 alpha-3 code of a country name,
+    or its normalised name if it is not an ISO 3166 country.
+    """
+    code = country_code(name)
+    return code if code is not None else _name_key(name)
+
+
+def parse_country_facets(content):
+    """
+    Returns the {country name: facet id} found in the country facet
+    of a DTM reports page.
+    """
+    soup = BeautifulSoup ( content , "html.parser" )
+
+    facets = {}
+    for link in soup.find_all('a', href=True):
+        match = FACET_PATTERN.search(unquote(link['href']))
+        if match is None:
+            continue
+        label = link.find('span', attrs={'class': "facet-item__value"})
+        name = (label or link).get_text(" ", strip=True)
+        facets[COUNT_PATTERN.sub("", name)] = int(match.group(1))
+    return facets
+
+
+class CountryIndex():
+    """
+    Persisted index of the DTM country facets.
+
+    Every entry is keyed by the normalised country (see `normalise_country`)
+    and holds the name used by DTM and its facet id.
+
+    """
+
+    def __init__(self, path, ttl=COUNTRY_INDEX_TTL, get=None, verbose=True):
+        self.path = path
+        self.ttl = ttl
+        self.verbose = verbose
+        # Whether a refresh failed, in which case the index on disk is used
+        # until the end of the run
+        self.refresh_failed = False
+        # Function sending the GET request, e.g. through the politeness scheduler
+        self.get = get if get is not None else requests.get
+
+        self.fetched_at = 0
+        self.countries = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding='utf-8') as file:
+                index = json.load(file)
+            self.fetched_at = index['fetched_at']
+            self.countries = index['countries']
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    def refresh(self):
+        """
+        Scrapes the country facets of the DTM reports page and saves them.
+        """
+        response = self.get(DTM_REPORTS_URL, timeout=60)
+        response.raise_for_status()
+
+        facets = parse_country_facets(response.content)
+        if not facets:
+            raise ValueError(f"No country facet found on {DTM_REPORTS_URL}")
+
+        unmapped = sorted(name for name in facets if country_code(name) is None)
+        if unmapped and self.verbose:
+            print(f"No ISO 3166 code for the DTM countries {', '.join(unmapped)}, "
+                  "add them to COUNTRY_ALIASES")
+
+        self.countries = {normalise_country(name): {'name': name, 'code': code}
+                          for name, code in facets.items()}
+        self.fetched_at = time.time()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as file:
+            json.dump({'fetched_at': self.fetched_at, 'countries': self.countries},
+                      file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def _refresh_if_stale(self):
+        # A failed refresh falls back on the stale index, if there is one
+        if not self.is_stale() or self.refresh_failed:
+            return
+        try:
+            self.refresh()
+        except (requests.RequestException, ValueError) as e:
+            if not self.countries:
+                raise
+            self.refresh_failed = True
+            if self.verbose:
+                print(f"Could not refresh the DTM country index ({e}), "
+                      f"using the one of {time.ctime(self.fetched_at)}")
+
+    def all(self):
+        """
+        Returns the {DTM name: facet id} of every country.
+        """
+        self._refresh_if_stale()
+        return {entry['name']: entry['code'] for entry in self.countries.values()}
+
+    def lookup(self, country):
+        """
+        Returns the DTM name and facet id of a country, or None if DTM
+        has no report for it.
+
+        Parameters:
+            country (str): country name, as DTM or the dashboard spell it
+        """
+        self._refresh_if_stale()
+        entry = self.countries.get(normalise_country(country))
+        if entry is None:
+            return None
+        return entry['name'], entry['code']
@@ -0,0 +1,126 @@
+""" Extraction cache
+Local SQLite database keeping the text of every page of the reports,
+keyed by content hash, page and extractor version, and the settings every
+report was last chunked with.
+
+Pages can be recorded by ranges as they are extracted, so that an
+interrupted run of a slow extractor resumes where it stopped.
+
+A new run skips the reports already chunked with the same settings, and
+re-chunks from the cached text, without opening the PDFs again, when only
+the chunking settings changed.
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+
+
+EXTRACTION_CACHE_FILENAME = "extraction_cache.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    sha256 TEXT,
+    extractor TEXT,
+    page INTEGER,
+    text BLOB,
+    PRIMARY KEY (sha256, extractor, page)
+);
+CREATE TABLE IF NOT EXISTS extractions (
+    sha256 TEXT,
+    extractor TEXT,
+    page_count INTEGER,
+    PRIMARY KEY (sha256, extractor)
+);
+CREATE TABLE IF NOT EXISTS chunkings (
+    sha256 TEXT,
+    chunks_dir TEXT,
+    settings TEXT,
+    nb_chunks INTEGER,
+    chunked_at REAL,
+    PRIMARY KEY (sha256, chunks_dir)
+);
+"""
+
+
+class ExtractionCache():
+    """
+    Cache of the extraction of the reports.
+
+    - pages: text of every page (zlib-compressed), per report hash and extractor version
+    - extractions: number of pages of every report extracted, even partly, by an extractor
+    - chunkings: settings and number of chunks of the last chunking of a report
+      into a chunks directory
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def pages(self, sha256, extractor, start=0, stop=None):
+        """
+        Returns the text of the pages [start, stop) of a report, in page order,
+        all of them by default, or None if some were not extracted by `extractor` yet.
+        """
+        with self._lock:
+            extraction = self.connection.execute(
+                "SELECT page_count FROM extractions WHERE sha256 = ? AND extractor = ?",
+                (sha256, extractor)).fetchone()
+            if extraction is None:
+                return None
+            stop = extraction[0] if stop is None else min(stop, extraction[0])
+            rows = self.connection.execute(
+                """SELECT text FROM pages WHERE sha256 = ? AND extractor = ?
+                AND page >= ? AND page < ? ORDER BY page""",
+                (sha256, extractor, start, stop)).fetchall()
+        if len(rows) != max(stop - start, 0):
+            return None
+        return [zlib.decompress(text).decode("utf8") for (text,) in rows]
+
+    def put_pages(self, sha256, extractor, pages, start=0, page_count=None):
+        """
+        Records the text of the pages of a report from page `start` on,
+        all the pages of the report by default.
+
+        Parameters:
+            pages (list): text of the pages, in page order
+            start (int): number of the first page
+            page_count (int): number of pages of the report, needed when
+                only a range of its pages is recorded
+        """
+        if page_count is None:
+            page_count = start + len(pages)
+        rows = [(sha256, extractor, start + page, zlib.compress(text.encode("utf8"), 1))
+                for page, text in enumerate(pages)]
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO extractions (sha256, extractor, page_count) VALUES (?, ?, ?)",
+                (sha256, extractor, page_count))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pages (sha256, extractor, page, text) VALUES (?, ?, ?, ?)",
+                rows)
+
+    def chunking(self, sha256, chunks_dir):
+        """
+        Returns the settings and the number of chunks of the last chunking
+        of a report into `chunks_dir`, or None.
+        """
+        with self._lock:
+            return self.connection.execute(
+                "SELECT settings, nb_chunks FROM chunkings WHERE sha256 = ? AND chunks_dir = ?",
+                (sha256, chunks_dir)).fetchone()
+
+    def put_chunking(self, sha256, chunks_dir, settings, nb_chunks):
+        with self._lock, self.connection:
+            self.connection.execute(
+                """INSERT OR REPLACE INTO chunkings (sha256, chunks_dir, settings, nb_chunks, chunked_at)
+                VALUES (?, ?, ?, ?, ?)""",
+                (sha256, chunks_dir, settings, nb_chunks, time.time()))
@@ -0,0 +1,68 @@
+""" Crawl manifest
+Keeps track of the DTM reports already downloaded, keyed by source URL,
+so that a new crawl only fetches and processes the reports that changed.
+"""
+
+import json
+import os
+import threading
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+class ReportManifest():
+    """
+    Persistent record of the downloaded reports.
+
+    Every entry is keyed by the source URL of the report and holds:
+    - file: name of the PDF in the reports directory
+    - etag, last_modified: HTTP validators sent back in conditional requests
+    - size, sha256: size and hash of the downloaded content
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.isfile(path):
+            with open(path, "r", encoding='utf-8') as file:
+                self.entries = json.load(file)
+        else:
+            self.entries = {}
+
+    def get(self, url):
+        with self._lock:
+            return self.entries.get(url)
+
+    def conditional_headers(self, url):
+        """
+        Returns the headers asking the server to answer '304 Not Modified'
+        if the report did not change since it was recorded.
+        """
+        entry = self.get(url)
+        if entry is None:
+            return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url, **fields):
+        with self._lock:
+            self.entries.setdefault(url, {}).update(fields)
+
+    def save(self):
+        """
+        Writes the manifest atomically, so that a crash never leaves
+        a truncated file behind.
+        """
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding='utf-8') as file:
+                json.dump(self.entries, file, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
@@ -8,21 +8,43 @@ python3 report2chunks.py
 import os
 
 from webscraper import scrap_DTM_reports
+from chunk_embeddings import embed_chunks
 from data_extraction import Extractor
+from vector_index import index_chunks
 
 
 def main(PATH='.', reports_dir="dtm_reports", chunks_dir="dtm_chunks",
-         verbose = True):
+         verbose = True, workers=1, extraction_workers=1, tables_dir=None,
+         extraction_backend='text', embeddings_dir=None, index_dir=None):
     
     reports_dir = os.path.join(PATH, reports_dir)
     chunks_dir = os.path.join(PATH, chunks_dir)
     
     print("--- Web scrapping ---")
-    scrap_DTM_reports(reports_dir=reports_dir, verbose=verbose)
+    scrap_DTM_reports(reports_dir=reports_dir, verbose=verbose, workers=workers)
 
     print("--- Converting PDF into chunks")
+    # Only the new or updated reports, and the reports chunked with other
+    # settings (extractor, cleaner...), are converted
     extractor = Extractor()
-    extractor.pdf_to_chunks(reports_dir, chunks_dir, verbose=verbose)
+    extractor.pdf_to_chunks(reports_dir, chunks_dir, workers=extraction_workers,
+                            backend=extraction_backend, verbose=verbose)
+
+    if tables_dir is not None:
+        print("--- Extracting tables")
+        extractor.pdf_to_tables(reports_dir, os.path.join(PATH, tables_dir),
+                                workers=extraction_workers, verbose=verbose)
+
+    if embeddings_dir is not None:
+        print("--- Embedding chunks")
+        # Only the new or changed chunks are embedded
+        embed_chunks(chunks_dir, os.path.join(PATH, embeddings_dir), verbose=verbose)
+
+    if index_dir is not None:
+        print("--- Indexing chunks")
+        # Only the new or changed chunks are added, embedded if needed
+        index_chunks(chunks_dir, os.path.join(PATH, embeddings_dir or "dtm_embeddings"),
+                     os.path.join(PATH, index_dir), backend='ivf', verbose=verbose)
     
 
 if __name__ == "__main__":
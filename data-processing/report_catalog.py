@@ -0,0 +1,160 @@
+""" Report catalog
+Local SQLite database with one row per report (i.e. per content hash).
+
+It holds everything the pipeline needs to know about a report — sources,
+country, year, page count, publication date and processing state — so
+reports can be selected by query without opening a single PDF.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+CATALOG_FILENAME = "catalog.sqlite"
+
+# Processing states of a report, in order
+DOWNLOADED = 'downloaded'
+CHUNKED = 'chunked'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    sha256 TEXT PRIMARY KEY,
+    title TEXT,
+    country TEXT,
+    year INTEGER,
+    page_count INTEGER,
+    published_on TEXT,
+    state TEXT DEFAULT 'downloaded',
+    added_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS report_names (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT REFERENCES reports (sha256)
+);
+CREATE TABLE IF NOT EXISTS report_sources (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT REFERENCES reports (sha256)
+);
+CREATE INDEX IF NOT EXISTS reports_selection ON reports (country, year, state);
+CREATE INDEX IF NOT EXISTS report_names_sha256 ON report_names (sha256);
+"""
+
+# Columns that can be filtered on in `select`
+FILTERS = ('sha256', 'country', 'year', 'state')
+
+
+class ReportCatalog():
+    """
+    Catalog of the reports of the store.
+
+    - reports: one row per content hash, with its metadata and processing state
+    - report_names: human-readable names of the reports in the reports directory
+    - report_sources: URLs the reports were downloaded from
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_report(self, sha256, name, source=None, title=None, country=None, year=None):
+        """
+        Records a report and links `name` (and `source`) to it.
+        An already known content keeps its metadata and state.
+        """
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute(
+                """INSERT OR IGNORE INTO reports (sha256, title, country, year, added_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (sha256, title, country, year, now, now))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO report_names (name, sha256) VALUES (?, ?)",
+                (name, sha256))
+            if source is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO report_sources (url, sha256) VALUES (?, ?)",
+                    (source, sha256))
+
+    def update(self, sha256, **columns):
+        """
+        Updates columns of a report, e.g. its state or page count.
+        """
+        columns['updated_at'] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self._lock, self.connection:
+            self.connection.execute(
+                f"UPDATE reports SET {assignments} WHERE sha256 = ?",
+                (*columns.values(), sha256))
+
+    def hash_of(self, name):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT sha256 FROM report_names WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row['sha256']
+
+    def select(self, not_state=None, **filters):
+        """
+        Returns the reports matching the filters, with one of their names.
+
+        Parameters:
+            not_state (str): excludes the reports in this state, e.g. CHUNKED
+            filters: values of the columns in FILTERS, e.g. country='Somalia', year=2024
+
+        Example:
+            catalog.select(country='Somalia', year=2024, not_state=CHUNKED)
+        """
+        conditions = []
+        values = []
+        for column, value in filters.items():
+            if column not in FILTERS:
+                raise KeyError(f"Cannot select reports on {column}")
+            conditions.append(f"reports.{column} = ?")
+            values.append(value)
+        if not_state is not None:
+            conditions.append("reports.state != ?")
+            values.append(not_state)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._lock:
+            rows = self.connection.execute(
+                f"""SELECT reports.*, MIN(report_names.name) AS name
+                FROM reports JOIN report_names USING (sha256)
+                {where}
+                GROUP BY reports.sha256
+                ORDER BY name""", values).fetchall()
+        return [dict(row) for row in rows]
+
+    def metadata(self, sha256):
+        """
+        Returns the metadata of a report, with the PDF-style keys
+        used in the chunks ('/Title', '/Country'...).
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT * FROM reports WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return {}
+            names = [name for (name,) in self.connection.execute(
+                "SELECT name FROM report_names WHERE sha256 = ? ORDER BY name", (sha256,))]
+            sources = [url for (url,) in self.connection.execute(
+                "SELECT url FROM report_sources WHERE sha256 = ? ORDER BY url", (sha256,))]
+
+        metadata = {
+            '/Title': row['title'],
+            '/Country': row['country'],
+            '/Year': None if row['year'] is None else str(row['year']),
+            '/PublishedOn': row['published_on'],
+            '/Names': names,
+            '/Sources': sources
+        }
+        return {key: value for key, value in metadata.items() if value is not None}
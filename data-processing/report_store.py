@@ -0,0 +1,102 @@
+""" Report store
+Content-addressed storage of the DTM reports.
+
+Every report is stored once under its SHA-256, whatever the number of
+listings or countries it was found under. Human-readable names in the
+reports directory are hard links to the stored file, and the report
+catalog records the names, sources and metadata of every stored report.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+from report_catalog import CATALOG_FILENAME, ReportCatalog
+
+
+BLOBS_DIRNAME = "blobs"
+HASH_CHUNK_SIZE = 1 << 16
+
+
+def sha256_of_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256
+
+
+class ReportStore():
+    """
+    Content-addressed store of the reports saved in `reports_dir`.
+
+    - reports_dir/blobs/ab/abcd...ef.pdf: content of every report, named by its hash
+    - reports_dir/<name>.pdf: hard links to the blobs
+    - reports_dir/catalog.sqlite: report catalog (see ReportCatalog)
+
+    """
+
+    def __init__(self, reports_dir):
+        self.reports_dir = reports_dir
+        self.blobs_dir = os.path.join(reports_dir, BLOBS_DIRNAME)
+        self.catalog = ReportCatalog(os.path.join(reports_dir, CATALOG_FILENAME))
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.catalog.close()
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blobs_dir, sha256[:2], f"{sha256}.pdf")
+
+    def add(self, file_path, sha256, name, source=None, **metadata):
+        """
+        Moves a downloaded report into the store, unless the same content
+        is already stored, and links `name` to it.
+
+        Parameters:
+            file_path (str): path of the downloaded report, consumed
+            sha256 (str): hash of its content
+            name (str): human-readable name of the report in the reports directory
+            source (str): URL the report was downloaded from
+            metadata: title, country and year of the report
+
+        Returns:
+            is_new (bool): whether the content was not stored yet
+        """
+        blob_path = self.blob_path(sha256)
+        with self._lock:
+            is_new = not os.path.isfile(blob_path)
+            if is_new:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(file_path, blob_path)
+            else:
+                os.remove(file_path)
+
+            self._link(blob_path, name)
+
+        self.catalog.add_report(sha256, name, source=source, **metadata)
+        return is_new
+
+    def _link(self, blob_path, name):
+        link_path = os.path.join(self.reports_dir, name)
+        tmp_path = link_path + ".tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob_path, tmp_path)
+        except OSError:
+            # The file system does not support hard links
+            shutil.copyfile(blob_path, tmp_path)
+        os.replace(tmp_path, link_path)
+
+    def hash_of(self, name):
+        """
+        Returns the hash of the report named `name` in the reports directory.
+        Reports that were not saved by the crawler are added to the catalog.
+        """
+        sha256 = self.catalog.hash_of(name)
+        if sha256 is None:
+            sha256 = sha256_of_file(os.path.join(self.reports_dir, name)).hexdigest()
+            self.catalog.add_report(sha256, name)
+        return sha256
@@ -0,0 +1,164 @@
+""" Table extraction
+Detects the tables of the reports page by page with PyMuPDF and saves
+them in a columnar table store, so that figures such as IDP counts by
+region can be queried directly instead of being read again from text.
+
+Tables are stored in long format, one Parquet file per report and one
+row per cell: the report, page, table, row and column of the cell, the
+header of its column, its text and, for numeric cells, its value.
+"""
+
+import glob
+import os
+import re
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pymupdf
+
+
+TABLE_PAGES_PER_TASK = 4
+
+CELL_SCHEMA = pa.schema([
+    ('sha256', pa.string()),
+    ('page', pa.int32()),
+    ('table', pa.int32()),
+    ('x0', pa.float32()),
+    ('y0', pa.float32()),
+    ('x1', pa.float32()),
+    ('y1', pa.float32()),
+    ('row', pa.int32()),
+    ('column', pa.int32()),
+    ('header', pa.string()),
+    ('text', pa.string()),
+    ('value', pa.float64()),
+    ('is_percent', pa.bool_()),
+])
+
+# Numbers as printed in the reports: "1,250", "-3.5", "13%", "(1,200)"
+NUMBER_PATTERN = re.compile(r"^\(?([-+]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\)?\s*(%?)$")
+
+
+def parse_number(text):
+    """
+    Returns the value of a numeric cell and whether it is a percentage,
+    (None, False) if the cell is not a number.
+    """
+    match = NUMBER_PATTERN.match(text.strip())
+    if match is None:
+        return None, False
+    value = float(match.group(1).replace(",", ""))
+    if text.strip().startswith("("):
+        value = -value
+    return value, match.group(2) == "%"
+
+
+def extract_page_tables(filename, start=0, stop=None):
+    """
+    Detects the tables of the pages [start, stop) of a PDF file.
+    Runs in the worker processes, so the cells are returned as plain columns.
+
+    Returns:
+        columns (dict): for every column of CELL_SCHEMA but 'sha256',
+            the list of the values of the cells
+    """
+    names = [field.name for field in CELL_SCHEMA if field.name != 'sha256']
+    columns = {name: [] for name in names}
+    with pymupdf.open(filename) as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for page_number in range(start, stop):
+            for i_table, table in enumerate(doc[page_number].find_tables().tables):
+                headers = [name or "" for name in table.header.names]
+                # A header found inside the table is its first row
+                rows = table.extract()
+                if not table.header.external:
+                    rows = rows[1:]
+                for i_row, row in enumerate(rows):
+                    for i_column, text in enumerate(row):
+                        if text is None:
+                            continue
+                        value, is_percent = parse_number(text)
+                        cell = (page_number, i_table, *table.bbox, i_row, i_column,
+                                headers[i_column] if i_column < len(headers) else "",
+                                text, value, is_percent)
+                        for name, item in zip(names, cell):
+                            columns[name].append(item)
+    return columns
+
+
+class TableStore():
+    """
+    Tables of the reports saved in `tables_dir`, in one Parquet file
+    of cells per report (see CELL_SCHEMA), named after its hash.
+
+    Example:
+        store = TableStore("dtm_tables")
+        cells = store.load(columns=['sha256', 'header', 'value']).to_pandas()
+        tables = store.frames(sha256)
+    """
+
+    def __init__(self, tables_dir):
+        self.tables_dir = tables_dir
+
+    def path(self, sha256):
+        return os.path.join(self.tables_dir, f"{sha256}.parquet")
+
+    def has(self, sha256):
+        return os.path.isfile(self.path(sha256))
+
+    def write(self, sha256, columns):
+        """
+        Saves the cells of the tables of a report, written atomically.
+
+        Parameters:
+            sha256 (str): hash of the report
+            columns (list): columns of the cells of page ranges
+                (see `extract_page_tables`), in page order
+        """
+        names = [field.name for field in CELL_SCHEMA if field.name != 'sha256']
+        cells = {name: [value for part in columns for value in part[name]] for name in names}
+        cells['sha256'] = [sha256] * len(cells['page'])
+        table = pa.Table.from_pydict(cells, schema=CELL_SCHEMA)
+
+        os.makedirs(self.tables_dir, exist_ok=True)
+        path = self.path(sha256)
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return len(set(zip(cells['page'], cells['table'])))
+
+    def load(self, columns=None, filters=None):
+        """
+        Reads the cells of all the reports as a single table.
+
+        Parameters:
+            columns (list): columns to read (see CELL_SCHEMA), all by default
+            filters (list): row filters of pyarrow.parquet.read_table,
+                e.g. [('header', '=', 'IDPs'), ('value', '>', 0)]
+        """
+        paths = sorted(glob.glob(os.path.join(self.tables_dir, "*.parquet")))
+        if not paths:
+            return CELL_SCHEMA.empty_table() if columns is None else \
+                CELL_SCHEMA.empty_table().select(columns)
+        return pq.read_table(paths, columns=columns, filters=filters, schema=CELL_SCHEMA)
+
+    def frames(self, sha256):
+        """
+        Rebuilds the tables of a report.
+
+        Returns:
+            tables (dict): DataFrame of every table, keyed by (page, table).
+                Columns whose cells are all numbers hold their values.
+        """
+        cells = pq.read_table(self.path(sha256)).to_pandas()
+        tables = {}
+        for (page, i_table), table_cells in cells.groupby(['page', 'table']):
+            text = table_cells.pivot(index='row', columns='column', values='text')
+            values = table_cells.pivot(index='row', columns='column', values='value')
+            headers = table_cells.groupby('column')['header'].first()
+            for column in text.columns:
+                numeric = text[column].notna() & (text[column].str.strip() != "")
+                if numeric.any() and values[column][numeric].notna().all():
+                    text[column] = values[column]
+            text.columns = [headers[column] or f"column_{column}" for column in text.columns]
+            tables[(page, i_table)] = text.reset_index(drop=True)
+        return tables
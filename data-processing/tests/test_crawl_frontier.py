@@ -0,0 +1,77 @@
+from crawl_frontier import DONE, PENDING, STALE, CrawlFrontier
+
+
+def _reports(frontier):
+    rows = frontier.connection.execute("SELECT url, idx, state FROM reports ORDER BY url")
+    return {row['url']: (row['idx'], row['state']) for row in rows}
+
+
+def _crawl(frontier, listings):
+    # Fetches the listing pages of `listings`, {(country, year, page): links},
+    # and returns the report URLs fetched, in order
+    fetched = []
+    codes = set()
+
+    def fetch_listing(task):
+        codes.add(task['code'])
+        return listings.get((task['country'], task['year'], task['page']), [])
+
+    def fetch_report(task):
+        fetched.append(task['url'])
+
+    frontier.run(fetch_listing, fetch_report, workers=1, verbose=False)
+    # Failures are retried by `run`, so the facet ids are checked afterwards
+    assert codes <= {7}
+    return fetched
+
+
+def test_reports_listed_several_times_fetched_once(tmp_path):
+    frontier = CrawlFrontier(str(tmp_path / "frontier.sqlite"))
+    frontier.seed({'Somalia': 7}, [2024])
+    fetched = _crawl(frontier, {
+        ('Somalia', 2024, 0): ["a.pdf", "b.pdf", "a.pdf"],
+        ('Somalia', 2024, 1): ["b.pdf", "c.pdf"],
+    })
+
+    assert sorted(fetched) == ["a.pdf", "b.pdf", "c.pdf"]
+    assert _reports(frontier) == {"a.pdf": (0, DONE), "b.pdf": (1, DONE), "c.pdf": (2, DONE)}
+    assert not frontier.has_pending()
+    frontier.close()
+
+
+def test_recrawl_fetches_only_reports_listed_again(tmp_path):
+    path = str(tmp_path / "frontier.sqlite")
+    frontier = CrawlFrontier(path)
+    frontier.seed({'Somalia': 7}, [2024])
+    _crawl(frontier, {('Somalia', 2024, 0): ["a.pdf", "b.pdf", "c.pdf"]})
+    frontier.close()
+
+    frontier = CrawlFrontier(path)
+    frontier.seed({'Somalia': 7}, [2024])
+    fetched = _crawl(frontier, {('Somalia', 2024, 0): ["c.pdf", "d.pdf"]})
+
+    assert sorted(fetched) == ["c.pdf", "d.pdf"]
+    assert _reports(frontier) == {"a.pdf": (0, STALE), "b.pdf": (1, STALE),
+                                  "c.pdf": (2, DONE), "d.pdf": (3, DONE)}
+    frontier.close()
+
+
+def test_crawl_resumes_after_crash(tmp_path):
+    path = str(tmp_path / "frontier.sqlite")
+    frontier = CrawlFrontier(path)
+    frontier.seed({'Somalia': 7}, [2024])
+    task, = frontier.claim(1)
+    frontier.complete_listing(task, ["a.pdf", "b.pdf"])
+    frontier.claim(2)
+    # Crash with the next listing page and a report running
+    frontier.close()
+
+    frontier = CrawlFrontier(path)
+    assert _reports(frontier)["a.pdf"] == (0, PENDING)
+    # A new seed does not start over a crawl left unfinished
+    frontier.seed({'Somalia': 7}, [2024])
+    fetched = _crawl(frontier, {})
+
+    assert sorted(fetched) == ["a.pdf", "b.pdf"]
+    assert not frontier.has_pending()
+    frontier.close()
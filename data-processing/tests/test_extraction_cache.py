@@ -0,0 +1,69 @@
+import os
+import shutil
+
+import pytest
+
+from chunk_store import ChunkStore
+from data_extraction import Extractor
+from extraction_cache import ExtractionCache
+
+EXAMPLE_PDF = os.path.join(os.path.dirname(__file__), "..", "pdf_examples", "example1.pdf")
+
+
+@pytest.fixture(scope="module")
+def example_pages():
+    return Extractor().extract_pages(EXAMPLE_PDF, 0, None)
+
+
+def test_cached_pages_identical_to_extraction(tmp_path, example_pages):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    cache.put_pages("sha", "text/1", example_pages)
+
+    cached = cache.pages("sha", "text/1")
+    assert [page.encode("utf8") for page in cached] == [page.encode("utf8") for page in example_pages]
+    assert cache.pages("sha", "text/1", 3, 5) == example_pages[3:5]
+    assert cache.pages("sha", "text/2") is None
+    cache.close()
+
+
+def test_page_ranges_complete_once_all_recorded(tmp_path, example_pages):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    page_count = len(example_pages)
+    cache.put_pages("sha", "text/1", example_pages[4:8], 4, page_count)
+
+    assert cache.pages("sha", "text/1") is None
+    assert cache.pages("sha", "text/1", 4, 8) == example_pages[4:8]
+    assert cache.pages("sha", "text/1", 0, 4) is None
+
+    cache.put_pages("sha", "text/1", example_pages[:4], 0, page_count)
+    cache.put_pages("sha", "text/1", example_pages[8:], 8, page_count)
+    assert cache.pages("sha", "text/1") == example_pages
+    cache.close()
+
+
+def _chunk(reports_dir, chunks_dir, chunk_size):
+    Extractor().pdf_to_chunks(str(reports_dir), str(chunks_dir), chunk_size=chunk_size,
+                              pages_per_task=4, dedup=False)
+    return {name: (chunks_dir / name).read_bytes() for name in os.listdir(chunks_dir)
+            if name.endswith(".jsonl")}
+
+
+def test_rechunking_from_cache_identical_to_fresh_run(tmp_path, monkeypatch):
+    for name in ("fresh", "cached"):
+        os.makedirs(tmp_path / name / "reports")
+        shutil.copy(EXAMPLE_PDF, tmp_path / name / "reports")
+    fresh = _chunk(tmp_path / "fresh" / "reports", tmp_path / "fresh" / "chunks", 256)
+
+    _chunk(tmp_path / "cached" / "reports", tmp_path / "cached" / "chunks", 512)
+
+    # The new chunk size is applied to the cached text, without opening the PDF
+    def no_extraction(*args, **kwargs):
+        raise AssertionError("The report was extracted again")
+
+    monkeypatch.setattr(Extractor, "iter_pages", no_extraction)
+    cached = _chunk(tmp_path / "cached" / "reports", tmp_path / "cached" / "chunks", 256)
+
+    assert len(fresh) == 1
+    assert cached == fresh
+    sha256 = os.path.splitext(next(iter(fresh)))[0]
+    assert ChunkStore(str(tmp_path / "cached" / "chunks")).has(sha256)
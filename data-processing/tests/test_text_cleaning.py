@@ -0,0 +1,49 @@
+from text_cleaning import TextCleaner
+
+
+def _body(number):
+    # Lines of a page that are not repeated on the other pages
+    site = "ABCDEFGHIJ"[number % 10]
+    return "".join(f"Households of the site {site} in the area {area}.\n"
+                   for area in "KLMNOPQRST")
+
+
+def _page(number, figure=None):
+    text = "IOM\nUKRAINE RESPONSE\n" + _body(number)
+    if figure is not None:
+        text += figure + "\n"
+    return text + f"{number}\n"
+
+
+def test_running_headers_and_page_numbers_removed():
+    pages = [_page(number) for number in range(3, 9)]
+    cleaned = list(TextCleaner().clean(pages))
+
+    assert cleaned == [_body(number) for number in range(3, 9)]
+
+
+def test_percentages_at_page_edges_kept():
+    # The same figures at the bottom of many pages, above the page number
+    figures = ["46%", "6%", "46%", "6%", "46%", "6%"]
+    pages = [_page(number, figure) for number, figure in zip(range(1, 7), figures)]
+    cleaned = list(TextCleaner().clean(pages))
+
+    assert cleaned == [_body(number) + f"{figure}\n"
+                       for number, figure in zip(range(1, 7), figures)]
+
+
+def test_numbers_not_following_each_other_kept():
+    # Figures alone on their line that do not increase from a page to the next
+    values = ["63", "45", "63", "17", "63"]
+    pages = [_body(number) + f"{value}\n" for number, value in enumerate(values)]
+    cleaned = list(TextCleaner().clean(pages))
+
+    assert cleaned == pages
+
+
+def test_numbered_headers_removed():
+    pages = [f"Situation report, page {number} of 5\n" + _body(number)
+             for number in range(1, 6)]
+    cleaned = list(TextCleaner().clean(pages))
+
+    assert cleaned == [_body(number) for number in range(1, 6)]
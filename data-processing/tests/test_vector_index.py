@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+
+from vector_index import IVF_MIN_TRAIN_SIZE, VectorIndex
+
+DIM = 8
+
+
+def _unit_vectors(generator, nb):
+    vectors = generator.standard_normal((nb, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class _Reference():
+    # Chunks added to an index, searched by brute force
+
+    def __init__(self):
+        self.chunks = {}
+
+    def add(self, index, chunk_ids, vectors, countries, years):
+        index.add(chunk_ids, vectors, countries, years)
+        self.chunks.update(zip(chunk_ids, zip(vectors, countries, years)))
+
+    def remove(self, index, chunk_ids):
+        index.remove(chunk_ids)
+        for chunk_id in chunk_ids:
+            del self.chunks[chunk_id]
+
+    def search(self, queries, k, country=None, year=None):
+        chunk_ids = [chunk_id for chunk_id, (_, chunk_country, chunk_year) in self.chunks.items()
+                     if country in (None, chunk_country) and year in (None, chunk_year)]
+        vectors = np.array([self.chunks[chunk_id][0] for chunk_id in chunk_ids])
+        scores = queries @ vectors.T
+        return [[chunk_ids[i] for i in np.argsort(-query_scores)[:k]] for query_scores in scores]
+
+
+def _assert_same_results(index, reference, queries, k=5, country=None, year=None, nprobe=None):
+    results = index.search(queries, k, country=country, year=year, nprobe=nprobe)
+    assert [[chunk_id for chunk_id, _ in result] for result in results] \
+        == reference.search(queries, k, country, year)
+
+
+def _fill(index, reference, generator, nb):
+    # Adds `nb` chunks, then replaces a fifth of them and removes a tenth
+    chunk_ids = [f"report_{i}" for i in range(nb)]
+    countries = [["Somalia", "Yemen", "Haiti"][i % 3] for i in range(nb)]
+    years = [2020 + i % 4 for i in range(nb)]
+    reference.add(index, chunk_ids, _unit_vectors(generator, nb), countries, years)
+    replaced = chunk_ids[::5]
+    reference.add(index, replaced, _unit_vectors(generator, len(replaced)),
+                  countries[::5], years[::5])
+    reference.remove(index, chunk_ids[3::10])
+
+
+def test_exact_search_matches_brute_force(tmp_path):
+    generator = np.random.default_rng(0)
+    index = VectorIndex(str(tmp_path), DIM)
+    reference = _Reference()
+    _fill(index, reference, generator, 200)
+    queries = _unit_vectors(generator, 10)
+
+    assert len(index) == len(reference.chunks)
+    _assert_same_results(index, reference, queries)
+    _assert_same_results(index, reference, queries, country="Yemen")
+    _assert_same_results(index, reference, queries, year=2021)
+
+    index.compact()
+    assert index.nb_rows == len(index)
+    _assert_same_results(index, reference, queries)
+    index.close()
+
+    index = VectorIndex(str(tmp_path), DIM)
+    _assert_same_results(index, reference, queries, country="Haiti")
+    index.close()
+
+
+def test_ivf_search_of_all_lists_matches_brute_force(tmp_path):
+    generator = np.random.default_rng(1)
+    index = VectorIndex(str(tmp_path), DIM, backend='ivf')
+    reference = _Reference()
+    # Trained once it holds IVF_MIN_TRAIN_SIZE vectors
+    _fill(index, reference, generator, IVF_MIN_TRAIN_SIZE + 1000)
+    assert index.centroids is not None
+    queries = _unit_vectors(generator, 10)
+
+    nprobe = len(index.centroids)
+    _assert_same_results(index, reference, queries, nprobe=nprobe)
+    index.train(nlist=16)
+    _assert_same_results(index, reference, queries, nprobe=16)
+    index.close()
+
+
+def test_interrupted_runs_leave_the_index_as_it_was(tmp_path):
+    generator = np.random.default_rng(2)
+    index = VectorIndex(str(tmp_path), DIM)
+    reference = _Reference()
+    _fill(index, reference, generator, 100)
+    index.compact()
+    queries = _unit_vectors(generator, 10)
+    nb_rows = index.nb_rows
+    row_sizes = {index._path('vectors.f32'): DIM * 4,
+                 **{index._path(f"{name}.i32"): 4 for name in ('countries', 'years', 'lists')}}
+    next_generation = index._path('vectors.f32', index.generation + 1)
+    index.close()
+
+    # Rows appended but not recorded, and a compaction not committed
+    for path, row_size in row_sizes.items():
+        with open(path, "ab") as array_file:
+            array_file.write(b"\x01" * row_size * 3)
+    with open(next_generation, "wb") as vectors_file:
+        vectors_file.write(b"\x00" * DIM * 4)
+
+    index = VectorIndex(str(tmp_path), DIM)
+    assert index.nb_rows == nb_rows
+    assert not os.path.exists(next_generation)
+    assert all(os.path.getsize(path) == nb_rows * row_size for path, row_size in row_sizes.items())
+    _assert_same_results(index, reference, queries)
+    index.close()
+
+
+def test_dimension_mismatch_rejected(tmp_path):
+    VectorIndex(str(tmp_path), DIM).close()
+    with pytest.raises(ValueError):
+        VectorIndex(str(tmp_path), DIM + 1)
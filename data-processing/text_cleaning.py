@@ -0,0 +1,157 @@
+""" Text cleaning
+Normalizes the text of the pages of a report before chunking:
+- Unicode compatibility forms (ligatures, non-breaking spaces...), invisible
+  characters, blank runs and blank lines
+- words hyphenated at the end of a line, joined back
+- running headers and footers ("IOM", "UKRAINE RESPONSE", "Page 3 of 12"...),
+  found as lines repeated at the top or bottom of many pages, and page
+  numbers, found as numbers increasing from a page to the next
+
+Pages stream through the cleaner one at a time; repeated lines are counted
+by hash, a few pages ahead of the page being cleaned.
+"""
+
+import re
+import unicodedata
+from collections import Counter, deque
+
+
+# Identifies the cleaning in the chunking settings: bump it whenever
+# a change of the cleaning changes the cleaned text
+CLEANER_VERSION = 2
+
+# Number of non-blank lines at the top and at the bottom of a page
+# where running headers and footers are looked for
+EDGE_LINES = 4
+# Minimum number of pages an edge line must appear on to be removed
+MIN_REPEATS = 3
+# Number of pages read ahead of the page being cleaned
+LOOKAHEAD_PAGES = 8
+
+INVISIBLE_CHARS = re.compile("[\u00ad\u200b-\u200d\u2060\ufeff]")
+LINE_BREAKS = re.compile(r"\r\n?")
+# Blanks inside a line, indentation is kept for Markdown lists
+INNER_BLANKS = re.compile(r"(?<=\S)[^\S\n]+")
+TRAILING_BLANKS = re.compile(r"[^\S\n]+$", re.MULTILINE)
+BLANK_LINES = re.compile(r"\n{3,}")
+# A letter, a hyphen at the end of the line, then a lowercase letter on the next line
+HYPHENATED_WORD = re.compile(r"(?<=[^\W\d_])-\n[^\S\n]*(?=[a-z\u00df-\u00f6\u00f8-\u00ff])")
+DIGITS = re.compile(r"\d+")
+WORD_CHAR = re.compile(r"\w")
+LETTER = re.compile(r"[^\W\d_]")
+# A number alone on its line, possibly between dashes or bars ("- 3 -")
+PAGE_NUMBER = re.compile(r"[\s|\-\u2013\u2014]*(\d{1,4})[\s|\-\u2013\u2014]*")
+
+
+def normalize_text(text):
+    """
+    Returns the text in Unicode NFKC form, without invisible characters,
+    with single blanks inside lines and no more than one blank line in a row.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    text = INVISIBLE_CHARS.sub("", text)
+    text = LINE_BREAKS.sub("\n", text)
+    text = TRAILING_BLANKS.sub("", text)
+    text = INNER_BLANKS.sub(" ", text)
+    return BLANK_LINES.sub("\n\n", text)
+
+
+def _line_key(line):
+    # Hash of a line holding letters, the same on every page: numbers
+    # (page numbers, dates) are masked. Lines without letters ("46%", "63")
+    # are figures, never running headers: None
+    if LETTER.search(line) is None:
+        return None
+    return hash(DIGITS.sub("#", line.strip().lower()))
+
+
+def _page_number(line):
+    # Value of a line made of a number only, None otherwise
+    match = PAGE_NUMBER.fullmatch(line.strip())
+    return None if match is None else int(match.group(1))
+
+
+class TextCleaner():
+    """
+    Streaming cleaner of the pages of a report.
+
+    Parameters:
+        edge_lines (int): number of non-blank lines at the top and at the
+            bottom of a page that can be running headers or footers
+        min_repeats (int): minimum number of pages an edge line must be found on
+            to be removed
+        lookahead (int): number of pages read ahead, so that the headers of the
+            first pages are known when they are cleaned
+
+    After cleaning, `stats` holds the number of pages, of characters before and
+    after cleaning, and of header and footer lines removed.
+    """
+
+    def __init__(self, edge_lines=EDGE_LINES, min_repeats=MIN_REPEATS,
+                 lookahead=LOOKAHEAD_PAGES):
+        self.edge_lines = edge_lines
+        self.min_repeats = min_repeats
+        self.lookahead = lookahead
+        self.stats = {'pages': 0, 'chars': 0, 'cleaned_chars': 0, 'header_lines': 0}
+
+    def _edges(self, lines):
+        # Indices of the non-blank lines at the top and bottom of a page
+        # holding a letter or a digit (not Markdown rules such as '-----')
+        indices = [i for i, line in enumerate(lines) if WORD_CHAR.search(line)]
+        return set(indices[:self.edge_lines] + indices[-self.edge_lines:])
+
+    def _numbers(self, lines, edges):
+        # Numbers alone on an edge line of a page, by line
+        numbers = {}
+        for i in edges:
+            number = _page_number(lines[i])
+            if number is not None:
+                numbers[i] = number
+        return numbers
+
+    def _is_header(self, line, repeats):
+        key = _line_key(line)
+        return key is not None and repeats[key] >= self.min_repeats
+
+    def _strip(self, lines, edges, numbers, repeats, previous, following):
+        # Edge numbers are page numbers if they follow a number of the
+        # previous page or precede one of the next page
+        page_numbers = {i for i, number in numbers.items()
+                        if number - 1 in previous or number + 1 in following}
+        kept = [line for i, line in enumerate(lines)
+                if i not in edges or not (i in page_numbers or self._is_header(line, repeats))]
+        self.stats['header_lines'] += len(lines) - len(kept)
+        text = "".join(kept)
+        return HYPHENATED_WORD.sub("", text)
+
+    def clean(self, pages):
+        """
+        Yields the cleaned text of the pages, in order.
+        """
+        repeats = Counter()
+        window = deque()
+        # Edge numbers of the last page cleaned
+        previous = set()
+
+        def strip_first():
+            nonlocal previous
+            lines, edges, numbers = window.popleft()
+            following = set(window[0][2].values()) if window else set()
+            cleaned = self._strip(lines, edges, numbers, repeats, previous, following)
+            previous = set(numbers.values())
+            self.stats['cleaned_chars'] += len(cleaned)
+            return cleaned
+
+        for text in pages:
+            self.stats['pages'] += 1
+            self.stats['chars'] += len(text)
+            lines = normalize_text(text).splitlines(keepends=True)
+            edges = self._edges(lines)
+            # A line counts once per page
+            repeats.update({_line_key(lines[i]) for i in edges} - {None})
+            window.append((lines, edges, self._numbers(lines, edges)))
+            if len(window) > self.lookahead:
+                yield strip_first()
+
+        while window:
+            yield strip_first()
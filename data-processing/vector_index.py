@@ -0,0 +1,503 @@
+""" Vector index
+Nearest-neighbour search over the embeddings of the chunks, for retrieval.
+
+Two backends share the same files:
+- 'exact': cosine similarities with all the vectors, by blocks of rows
+- 'ivf': the vectors are clustered by k-means into inverted lists, and a
+  query is only compared to the vectors of the `nprobe` lists closest to it
+
+The index is saved in a directory: vectors and metadata as arrays appended
+to files and read through memory maps, the chunk ids and the countries in
+SQLite, the centroids of the lists in a NumPy file. Chunks can be added at
+any time; the lists are trained again when the index has grown enough, and
+the rows of the chunks replaced or removed since are dropped at the same time.
+Training writes a new generation of the files, which the index switches to in
+a single SQLite transaction. Searches can be restricted to countries and years
+before scoring.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from chunk_dedup import DEDUP_INDEX_FILENAME, DedupIndex
+from chunk_embeddings import EmbeddingStore, content_key, get_embedder
+from chunk_store import ChunkStore
+
+
+BACKENDS = ('exact', 'ivf')
+INDEX_FILENAME = "index.sqlite"
+# Number of vectors scored at once by the exact backend
+SEARCH_BLOCK_SIZE = 1 << 16
+# The lists are trained once the index holds that many vectors,
+# and trained again whenever it has grown by IVF_RETRAIN_GROWTH
+IVF_MIN_TRAIN_SIZE = 4096
+IVF_RETRAIN_GROWTH = 4
+# Number of vectors the k-means is trained on
+IVF_TRAIN_SAMPLE = 1 << 16
+IVF_TRAIN_ITERATIONS = 10
+IVF_NPROBE = 8
+# The files are compacted when the rows of the chunks replaced or removed
+# outnumber the live rows that many times
+COMPACT_DEAD_RATIO = 1
+NO_YEAR = -1
+
+# Arrays of the index, one value per row, and their type
+ARRAYS = {
+    'countries': np.int32,
+    'years': np.int32,
+    'lists': np.int32,
+}
+# Files of a generation of the index, suffixed by the generation number
+# from the first training on
+FILE_PATTERN = re.compile(r"(vectors|countries|years|lists|centroids)(?:\.(\d+))?\.(f32|i32|npy)")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    key BLOB,
+    row INTEGER
+);
+CREATE TABLE IF NOT EXISTS countries (
+    country TEXT PRIMARY KEY,
+    code INTEGER
+);
+"""
+
+
+def _nearest_centroids(vectors, centroids, nb=1):
+    # Indices of the `nb` centroids closest to every vector, by blocks of vectors
+    nearest = np.empty((len(vectors), nb), dtype=np.int64)
+    for start in range(0, len(vectors), SEARCH_BLOCK_SIZE):
+        scores = np.asarray(vectors[start:start + SEARCH_BLOCK_SIZE]) @ centroids.T
+        if nb < len(centroids):
+            nearest[start:start + SEARCH_BLOCK_SIZE] = np.argpartition(-scores, nb - 1, axis=1)[:, :nb]
+        else:
+            nearest[start:start + SEARCH_BLOCK_SIZE] = np.argsort(-scores, axis=1)[:, :nb]
+    return nearest
+
+
+def train_centroids(vectors, nlist, iterations=IVF_TRAIN_ITERATIONS, seed=0):
+    """
+    Clusters unit vectors into `nlist` lists by spherical k-means.
+
+    Returns:
+        centroids (numpy.ndarray): unit centroids, one row per list
+    """
+    generator = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[generator.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest_centroids(vectors, centroids)[:, 0]
+        order = np.argsort(assignments, kind='stable')
+        sizes = np.bincount(assignments, minlength=nlist)
+        non_empty = sizes > 0
+        starts = np.cumsum(sizes) - sizes
+        centroids[non_empty] = np.add.reduceat(vectors[order], starts[non_empty], axis=0)
+        # Empty lists start again from random vectors
+        centroids[~non_empty] = vectors[generator.choice(len(vectors), (~non_empty).sum())]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class VectorIndex():
+    """
+    Index of the vectors of the chunks in `index_dir`.
+
+    Parameters:
+        index_dir (str): directory of the index files
+        dim (int): number of dimensions of the vectors
+        backend (str): 'exact' or 'ivf'; the 'ivf' backend searches exactly
+            until it holds IVF_MIN_TRAIN_SIZE vectors, and when the filters
+            of a search leave no more than that
+        nprobe (int): number of lists searched by the 'ivf' backend
+
+    Example:
+        index = VectorIndex("dtm_index", 384, backend='ivf')
+        index.add(chunk_ids, vectors, countries, years)
+        results = index.search(query_vectors, k=10, country='Somalia', year=[2023, 2024])
+    """
+
+    def __init__(self, index_dir, dim, backend='exact', nprobe=IVF_NPROBE):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown index backend {backend}, expected one of {BACKENDS}")
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.dim = dim
+        self.backend = backend
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(index_dir, INDEX_FILENAME),
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("INSERT OR IGNORE INTO settings (name, value) VALUES ('dim', ?)",
+                                    (dim,))
+        stored_dim, = self.connection.execute(
+            "SELECT value FROM settings WHERE name = 'dim'").fetchone()
+        if stored_dim != dim:
+            raise ValueError(f"The index holds vectors of {stored_dim} dimensions, not {dim}")
+
+        rows = self.connection.execute("SELECT chunk_id, row FROM chunks").fetchall()
+        self.country_codes = dict(self.connection.execute("SELECT country, code FROM countries"))
+        self.trained_size = self._setting('trained_size')
+        self.generation = self._setting('generation')
+        self._remove_generations()
+        self.nb_rows = self._truncate()
+
+        # Row of every chunk, and chunk of every live row
+        self.rows = dict(rows)
+        self.chunk_ids = [None] * self.nb_rows
+        for chunk_id, row in rows:
+            self.chunk_ids[row] = chunk_id
+        self.live = np.zeros(self.nb_rows, dtype=bool)
+        self.live[[row for _, row in rows]] = True
+        self.centroids = None
+        if os.path.isfile(self._path('centroids.npy')):
+            self.centroids = np.load(self._path('centroids.npy'))
+        self._lists = None
+
+    def close(self):
+        self.connection.close()
+
+    def _path(self, name, generation=None):
+        # Path of a file of the current generation of the index, or of `generation`
+        generation = self.generation if generation is None else generation
+        if generation:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem}.{generation}{extension}"
+        return os.path.join(self.index_dir, name)
+
+    def _setting(self, name):
+        row = self.connection.execute(
+            "SELECT value FROM settings WHERE name = ?", (name,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def _remove_generations(self):
+        # Files of the other generations: the previous one once a training is
+        # committed, or the next one if the training was interrupted
+        for name in os.listdir(self.index_dir):
+            match = FILE_PATTERN.fullmatch(name)
+            if match is not None and int(match.group(2) or 0) != self.generation:
+                os.remove(os.path.join(self.index_dir, name))
+
+    def _truncate(self):
+        # Number of rows recorded; the rows appended by an interrupted run
+        # after the last recorded one are dropped
+        nb_rows = self._setting('nb_rows')
+        sizes = dict({'vectors.f32': self.dim * 4}, **{f"{name}.i32": 4 for name in ARRAYS})
+        for name, row_size in sizes.items():
+            path = self._path(name)
+            if not os.path.isfile(path):
+                open(path, "wb").close()
+            if os.path.getsize(path) > nb_rows * row_size:
+                os.truncate(path, nb_rows * row_size)
+        return nb_rows
+
+    def vectors(self):
+        """
+        Returns all the vectors of the index, memory-mapped, live or not.
+        """
+        if self.nb_rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self._path('vectors.f32'), dtype='<f4', mode='r',
+                         shape=(self.nb_rows, self.dim))
+
+    def array(self, name):
+        if self.nb_rows == 0:
+            return np.zeros(0, dtype=ARRAYS[name])
+        return np.memmap(self._path(f"{name}.i32"), dtype='<i4', mode='r', shape=(self.nb_rows,))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _country_code(self, country):
+        if country not in self.country_codes:
+            self.country_codes[country] = len(self.country_codes)
+            self.connection.execute("INSERT INTO countries (country, code) VALUES (?, ?)",
+                                    (country, self.country_codes[country]))
+        return self.country_codes[country]
+
+    def add(self, chunk_ids, vectors, countries, years, keys=None):
+        """
+        Adds chunks to the index, replacing the chunks with the same ids.
+
+        Parameters:
+            chunk_ids (list): ids of the chunks
+            vectors (numpy.ndarray): their unit vectors, one row per chunk
+            countries (list): their country, None if unknown
+            years (list): their year, None if unknown
+            keys (list): content hashes of their texts, to tell later whether
+                a chunk changed (see `keys`)
+        """
+        vectors = np.ascontiguousarray(vectors, dtype='<f4').reshape(-1, self.dim)
+        if keys is None:
+            keys = [None] * len(chunk_ids)
+        with self._lock, self.connection:
+            arrays = {
+                'countries': [-1 if country is None else self._country_code(country)
+                              for country in countries],
+                'years': [NO_YEAR if year is None else year for year in years],
+                'lists': (_nearest_centroids(vectors, self.centroids)[:, 0]
+                          if self.centroids is not None else np.full(len(vectors), -1)),
+            }
+            # Arrays are written before their rows are recorded
+            with open(self._path('vectors.f32'), "ab") as vectors_file:
+                vectors_file.write(vectors.tobytes())
+            for name, values in arrays.items():
+                with open(self._path(f"{name}.i32"), "ab") as array_file:
+                    array_file.write(np.asarray(values, dtype='<i4').tobytes())
+
+            new_rows = range(self.nb_rows, self.nb_rows + len(chunk_ids))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, key, row) VALUES (?, ?, ?)",
+                list(zip(chunk_ids, keys, new_rows)))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES ('nb_rows', ?)",
+                (self.nb_rows + len(chunk_ids),))
+
+            self.live = np.concatenate([self.live, np.ones(len(chunk_ids), dtype=bool)])
+            self.chunk_ids.extend(chunk_ids)
+            for chunk_id, row in zip(chunk_ids, new_rows):
+                if chunk_id in self.rows:
+                    self.live[self.rows[chunk_id]] = False
+                self.rows[chunk_id] = row
+            self.nb_rows += len(chunk_ids)
+            self._lists = None
+
+        if self.backend == 'ivf' and len(self) >= max(IVF_MIN_TRAIN_SIZE,
+                                                      IVF_RETRAIN_GROWTH * self.trained_size):
+            self.train()
+        else:
+            self._compact_if_sparse()
+
+    def remove(self, chunk_ids):
+        with self._lock, self.connection:
+            for chunk_id in chunk_ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self.live[row] = False
+            self.connection.executemany("DELETE FROM chunks WHERE chunk_id = ?",
+                                        [(chunk_id,) for chunk_id in chunk_ids])
+        self._compact_if_sparse()
+
+    def _compact_if_sparse(self):
+        if self.nb_rows - len(self) > COMPACT_DEAD_RATIO * len(self):
+            self.compact()
+
+    def keys(self):
+        """
+        Returns the content hash every chunk of the index was added with.
+        """
+        with self._lock:
+            return dict(self.connection.execute("SELECT chunk_id, key FROM chunks"))
+
+    def train(self, nlist=None):
+        """
+        Clusters the live vectors into `nlist` lists, about the square root
+        of their number by default, and assigns every vector to its list.
+
+        The index is compacted at the same time: the live rows are written
+        to the files of a new generation, without the rows of the chunks
+        replaced or removed, and the index switches to them in a single
+        transaction, so that an interrupted training leaves the index as it was.
+        """
+        with self._lock:
+            live_rows = np.flatnonzero(self.live)
+            if len(live_rows) == 0:
+                return
+            nlist = nlist or max(1, int(np.sqrt(len(live_rows))))
+            generator = np.random.default_rng(0)
+            sample = np.sort(generator.choice(live_rows, min(len(live_rows), IVF_TRAIN_SAMPLE),
+                                              replace=False))
+            centroids = train_centroids(self.vectors()[sample], min(nlist, len(sample)))
+            self._compact(live_rows, centroids, len(live_rows))
+
+    def compact(self):
+        """
+        Drops the rows of the chunks replaced or removed from the files,
+        keeping the current lists.
+        """
+        with self._lock:
+            self._compact(np.flatnonzero(self.live), self.centroids, self.trained_size)
+
+    def _compact(self, live_rows, centroids, trained_size):
+        # Writes the live rows to the files of a new generation, assigned to
+        # the lists of `centroids` if any, then switches to them
+        generation = self.generation + 1
+        vectors = self.vectors()
+        with open(self._path('vectors.f32', generation), "wb") as vectors_file, \
+                open(self._path('lists.i32', generation), "wb") as lists_file:
+            for start in range(0, len(live_rows), SEARCH_BLOCK_SIZE):
+                block = np.asarray(vectors[live_rows[start:start + SEARCH_BLOCK_SIZE]])
+                vectors_file.write(block.tobytes())
+                lists = (_nearest_centroids(block, centroids)[:, 0] if centroids is not None
+                         else np.full(len(block), -1))
+                lists_file.write(lists.astype('<i4').tobytes())
+        for name in ('countries', 'years'):
+            with open(self._path(f"{name}.i32", generation), "wb") as array_file:
+                array_file.write(np.asarray(self.array(name))[live_rows].astype('<i4').tobytes())
+        if centroids is not None:
+            with open(self._path('centroids.npy', generation), "wb") as centroids_file:
+                np.save(centroids_file, centroids)
+
+        # New row of every live chunk, in the order of the old rows
+        chunk_ids = [self.chunk_ids[row] for row in live_rows]
+        with self.connection:
+            self.connection.executemany("UPDATE chunks SET row = ? WHERE chunk_id = ?",
+                                        [(row, chunk_id) for row, chunk_id in enumerate(chunk_ids)])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)",
+                [('nb_rows', len(live_rows)), ('generation', generation),
+                 ('trained_size', trained_size)])
+
+        self.generation = generation
+        self.nb_rows = len(live_rows)
+        self.chunk_ids = chunk_ids
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(chunk_ids)}
+        self.live = np.ones(self.nb_rows, dtype=bool)
+        self.centroids = centroids
+        self.trained_size = trained_size
+        self._lists = None
+        self._remove_generations()
+
+    def _inverted_lists(self):
+        # Rows sorted by list, and the start of every list in them
+        if self._lists is None:
+            lists = np.asarray(self.array('lists'))
+            order = np.argsort(lists, kind='stable')
+            starts = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self._lists = (order, starts)
+        return self._lists
+
+    def _mask(self, country, year):
+        # Live rows of the countries and years searched
+        mask = self.live.copy()
+        if country is not None:
+            countries = [country] if isinstance(country, str) else country
+            codes = [self.country_codes[name] for name in countries if name in self.country_codes]
+            mask &= np.isin(self.array('countries'), codes)
+        if year is not None:
+            years = [year] if isinstance(year, int) else year
+            mask &= np.isin(self.array('years'), years)
+        return mask
+
+    def _top(self, rows, scores, k):
+        # The k rows of highest score, best first
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(self.chunk_ids[row], float(score)) for row, score in zip(rows[order], scores[order])]
+
+    def _search_exact(self, queries, k, mask):
+        vectors = self.vectors()
+        rows = np.flatnonzero(mask)
+        best_rows = [np.zeros(0, dtype=np.int64)] * len(queries)
+        best_scores = [np.zeros(0, dtype=np.float32)] * len(queries)
+        for start in range(0, len(rows), SEARCH_BLOCK_SIZE):
+            block = rows[start:start + SEARCH_BLOCK_SIZE]
+            # Contiguous rows are read as a slice of the memory map
+            if block[-1] - block[0] == len(block) - 1:
+                block_vectors = vectors[block[0]:block[-1] + 1]
+            else:
+                block_vectors = vectors[block]
+            scores = queries @ np.asarray(block_vectors).T
+            for i_query in range(len(queries)):
+                candidates = np.concatenate([best_rows[i_query], block])
+                candidate_scores = np.concatenate([best_scores[i_query], scores[i_query]])
+                if len(candidates) > k:
+                    best = np.argpartition(-candidate_scores, k - 1)[:k]
+                    candidates, candidate_scores = candidates[best], candidate_scores[best]
+                best_rows[i_query], best_scores[i_query] = candidates, candidate_scores
+        return [self._top(rows, scores, k) for rows, scores in zip(best_rows, best_scores)]
+
+    def _search_ivf(self, queries, k, mask, nprobe):
+        vectors = self.vectors()
+        order, starts = self._inverted_lists()
+        probes = _nearest_centroids(queries, self.centroids, min(nprobe, len(self.centroids)))
+        results = []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([order[starts[i_list]:starts[i_list + 1]] for i_list in lists])
+            rows = np.sort(rows[mask[rows]])
+            scores = np.asarray(vectors[rows]) @ query
+            results.append(self._top(rows, scores, k))
+        return results
+
+    def search(self, queries, k=10, country=None, year=None, nprobe=None):
+        """
+        Finds the chunks closest to query vectors, by cosine similarity.
+
+        Parameters:
+            queries (numpy.ndarray): unit query vectors, one row per query
+            k (int): number of chunks returned per query
+            country (str or list): only searches the chunks of these countries
+            year (int or list): only searches the chunks of these years
+            nprobe (int): number of lists searched by the 'ivf' backend,
+                `self.nprobe` by default
+
+        Returns:
+            results (list): for every query, (chunk_id, score) pairs, best first
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        mask = self._mask(country, year)
+        # The few chunks left by selective filters are faster to score all,
+        # and lists would hold few of them
+        if self.backend == 'ivf' and self.centroids is not None \
+                and np.count_nonzero(mask) > IVF_MIN_TRAIN_SIZE:
+            return self._search_ivf(queries, k, mask, nprobe or self.nprobe)
+        return self._search_exact(queries, k, mask)
+
+
+def index_chunks(chunks_dir, embeddings_dir, index_dir, chunk_format='jsonl',
+                 embedding_backend='auto', backend='exact', dedup=True, verbose=False):
+    """
+    Brings the vector index in `index_dir` up to date with the chunk store
+    in `chunks_dir`: chunks that are new or changed are embedded (see
+    EmbeddingStore) and added, chunks that are gone are removed.
+
+    Parameters:
+        dedup (bool): only indexes the canonical chunks of the near-duplicate
+            index of the chunk store, if any (see DedupIndex)
+
+    Returns:
+        nb_added, nb_removed (int): number of chunks added and removed
+    """
+    table = ChunkStore(chunks_dir, chunk_format).load(
+        columns=['id', 'page_content', 'country', 'year'])
+    dedup_path = os.path.join(chunks_dir, DEDUP_INDEX_FILENAME)
+    if dedup and os.path.isfile(dedup_path):
+        dedup_index = DedupIndex(dedup_path)
+        table = dedup_index.deduplicate(table)
+        dedup_index.close()
+
+    embedding_store = EmbeddingStore(embeddings_dir, get_embedder(embedding_backend))
+    index = VectorIndex(index_dir, embedding_store.embedder.dim, backend)
+    ids = table.column('id').to_pylist()
+    texts = table.column('page_content').to_pylist()
+    keys = [content_key(text) for text in texts]
+    indexed_keys = index.keys()
+    new = [i_chunk for i_chunk, (chunk_id, key) in enumerate(zip(ids, keys))
+           if indexed_keys.get(chunk_id) != key]
+    gone = set(indexed_keys) - set(ids)
+
+    index.remove(list(gone))
+    if new:
+        new_table = table.take(new)
+        rows = embedding_store.embed(new_table.column('page_content').to_pylist())
+        index.add(new_table.column('id').to_pylist(), embedding_store.matrix()[rows],
+                  new_table.column('country').to_pylist(), new_table.column('year').to_pylist(),
+                  [keys[i_chunk] for i_chunk in new])
+    if verbose:
+        print(f"Indexed {len(new)} new or changed chunks, removed {len(gone)}, "
+              f"{len(index)} chunks in the index")
+    embedding_store.close()
+    index.close()
+    return len(new), len(gone)
@@ -1,87 +1,341 @@
 """ Webscraper
 """
 
+import datetime
+import hashlib
+import json
 import os
+import re
+import sys
+from functools import partial
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-from PyPDF2 import PdfReader, PdfMerger
+import pymupdf
 
+sys.path.append(
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "src",
+        )
+    )
+)
 
-def scrap_DTM_reports(reports_dir, countries=None, 
-                      verbose=True):
-    
-    # TODO: scrap country codes automatically
-    code_countries = {
-        'Ethiopia':63,
-        'Somalia':80
-    }
+from pipeline.http_scheduler import HostScheduler, get_scheduler, request  # noqa: E402
+from pipeline.listing_extraction import DTM_REPORT_LINKS, extract_links  # noqa: E402
+
+from crawl_frontier import FRONTIER_FILENAME, CrawlFrontier
+from dtm_countries import COUNTRY_INDEX_FILENAME, CountryIndex
+from manifest import MANIFEST_FILENAME, ReportManifest
+from report_store import ReportStore, sha256_of_file
+
+
+DTM_URL_BASE = "https://dtm.iom.int/"
+DTM_FIRST_YEAR = 2014
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+PARTIAL_SUFFIX = ".part"
+# Validators of the response a partial file was downloaded from
+VALIDATORS_SUFFIX = ".validators.json"
+CONTENT_RANGE_START = re.compile(r"bytes (\d+)-")
+REQUEST_TIMEOUT = 60
+
+
+def make_session(pool_size=10):
+    """
+    Creates a keep-alive session whose connection pool can serve
+    `pool_size` concurrent requests per host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _range_headers(validators_path, offset):
+    # Range request of the rest of a partial file, only served if the remote
+    # file is still the one it was downloaded from (If-Range)
+    if not os.path.isfile(validators_path):
+        return None
+    with open(validators_path, encoding="utf8") as file:
+        validators = json.load(file)
+    # Weak ETags cannot be used in If-Range
+    etag = validators.get('etag')
+    if etag and not etag.startswith("W/"):
+        if_range = etag
+    else:
+        if_range = validators.get('last_modified')
+    if not if_range:
+        return None
+    return {'Range': f"bytes={offset}-", 'If-Range': if_range}
+
+
+def _save_validators(validators_path, validators):
+    with open(validators_path, "w", encoding="utf8") as file:
+        json.dump(validators, file)
+
+
+def download_report(session, url, file_path, scheduler=None, manifest=None,
+                    store=None, metadata=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Streams a single report to disk with the shared session.
+
+    The body is written in `chunk_size` pieces to `file_path + '.part'`,
+    which is renamed to `file_path` once complete, or moved into the report
+    store and linked to `file_path` when a store is given. If a partial file is
+    left by an interrupted run, the download resumes from its end with an
+    HTTP Range request, conditional on the ETag / Last-Modified of the first
+    response (If-Range, saved next to the partial file): the download starts
+    over if the remote file changed or the server cannot resume it.
+
+    When a manifest is given and the report is already on disk, the request
+    is conditional (ETag / Last-Modified) and the file is left untouched if
+    the server answers '304 Not Modified' or sends back the same content.
+
+    Parameters:
+        session (requests.Session): pooled session
+        url (str): URL of the PDF
+        file_path (str): path to save the PDF into
+        scheduler (HostScheduler): per-host politeness scheduler,
+            the shared one by default
+        manifest (ReportManifest): optional record of the previous downloads
+        store (ReportStore): optional content-addressed store to save the PDF into
+        metadata (dict): title, country and year recorded with the report
+            in the store
+        chunk_size (int): number of bytes read from the socket at a time
+
+    Returns:
+        changed (bool): whether a new version of the report was saved
+    """
+    if scheduler is None:
+        scheduler = get_scheduler()
+
+    part_path = file_path + PARTIAL_SUFFIX
+    validators_path = part_path + VALIDATORS_SUFFIX
+    entry = manifest.get(url) if manifest is not None else None
+    known = entry is not None and os.path.isfile(file_path)
+
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = _range_headers(validators_path, offset) if offset else None
+        if headers is None:
+            # A partial file that cannot be validated is downloaded again
+            offset = 0
+            headers = {}
+        if known and not offset:
+            headers.update(manifest.conditional_headers(url))
+
+        with scheduler.slot(url) as slot:
+            with session.get(url, headers=headers, stream=True,
+                             timeout=REQUEST_TIMEOUT) as response:
+                slot.record(response)
+                if response.status_code == 304:
+                    return False
+                if response.status_code == 416 and offset:
+                    # The partial file does not match the remote one anymore
+                    os.remove(part_path)
+                    continue
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    match = CONTENT_RANGE_START.match(response.headers.get('Content-Range', ""))
+                    if match is None or int(match.group(1)) != offset:
+                        # Not the rest of the partial file, start over
+                        os.remove(part_path)
+                        continue
+                    sha256 = sha256_of_file(part_path)
+                else:
+                    # The server ignored the Range header or the remote file
+                    # changed (If-Range), start over
+                    offset = 0
+                    sha256 = hashlib.sha256()
+
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+                if not offset:
+                    _save_validators(validators_path, validators)
+
+                with open(part_path, "ab" if offset else "wb") as file:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        sha256.update(chunk)
+                        file.write(chunk)
+        break
+
+    os.remove(validators_path)
+    digest = sha256.hexdigest()
+    size = os.path.getsize(part_path)
+    if known and entry.get('sha256') == digest:
+        # Same content served without validators, keep the existing file
+        os.remove(part_path)
+        changed = False
+    elif store is not None:
+        store.add(part_path, digest, os.path.basename(file_path),
+                  source=url, **(metadata or {}))
+        changed = True
+    else:
+        os.replace(part_path, file_path)
+        changed = True
+
+    if manifest is not None:
+        manifest.update(url, file=os.path.basename(file_path),
+                        size=size, sha256=digest, **validators)
+    return changed
+
+
+def DTM_listing_url(country_code, year, page):
+    return (f"{DTM_URL_BASE}reports?f%5B0%5D=published_date%3A{year}"
+            f"&f%5B1%5D=report_country%3A{country_code}&page={page}")
+
+
+def parse_DTM_listing(content):
+    """
+    Returns the links to the PDF reports found on a DTM listing page.
+    """
+    return extract_links(content, DTM_REPORT_LINKS)
+
+
+def scrap_DTM_reports(reports_dir, countries=None, years=None,
+                      verbose=True, workers=1, max_per_host=4,
+                      manifest=None):
+    """
+    Downloads the DTM reports of the given countries and years into `reports_dir`.
+
+    Every listing page of every (country, year) is read until the results
+    run out. The crawl state is kept in `reports_dir/frontier.sqlite`,
+    so that an interrupted crawl resumes where it stopped.
+
+    Reports are saved once per content in the report store, and their
+    metadata recorded in the report catalog; `report_{country}_{i}.pdf`
+    files are hard links to the stored content.
+
+    Parameters:
+        reports_dir (str): directory to save the reports into
+        countries (list): countries to scrap, as DTM or the dashboard name them,
+            all the countries with DTM reports by default
+        years (list): publication years to scrap, all years by default
+        verbose (bool): prints progress
+        workers (int): number of pages and reports fetched concurrently
+        max_per_host (int): upper bound of the requests in flight per host,
+            adapted by the politeness scheduler
+        manifest (ReportManifest): record of the previous downloads,
+            `reports_dir/manifest.json` by default
+    """
     
-    if countries is None:
-        countries = code_countries.keys()
+    if years is None:
+        years = range(DTM_FIRST_YEAR, datetime.date.today().year + 1)
     
     if not os.path.isdir(reports_dir):
         os.mkdir(reports_dir)
+
+    if manifest is None:
+        manifest = ReportManifest(os.path.join(reports_dir, MANIFEST_FILENAME))
+
+    session = make_session(pool_size=max(workers, max_per_host))
+    scheduler = HostScheduler(max_concurrency=max_per_host)
+
+    country_index = CountryIndex(os.path.join(reports_dir, COUNTRY_INDEX_FILENAME),
+                                 get=partial(request, "GET", session=session,
+                                             scheduler=scheduler),
+                                 verbose=verbose)
+    if countries is None:
+        code_countries = country_index.all()
+    else:
+        code_countries = {}
+        for country in countries:
+            entry = country_index.lookup(country)
+            if entry is not None:
+                code_countries[entry[0]] = entry[1]
+            elif verbose:
+                print(f"Unknown reference to country {country} code in URL")
+
+    frontier = CrawlFrontier(os.path.join(reports_dir, FRONTIER_FILENAME))
+    store = ReportStore(reports_dir)
+
+    def fetch_listing(task):
+        code = task['code']
+        if code is None:
+            # Listing left by a crawl from before the facet ids were stored
+            entry = country_index.lookup(task['country'])
+            if entry is None:
+                raise KeyError(f"No DTM facet for country {task['country']}")
+            code = entry[1]
+        URL = DTM_listing_url(code, task['year'], task['page'])
+        response = request("GET", URL, session=session, scheduler=scheduler,
+                           timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return parse_DTM_listing(response.content)
     
-    year = 2024
-    page = 0
-    
-    for country in countries:
-        if country  in code_countries.keys():
-            URL = f"https://dtm.iom.int/reports?f%5B0%5D=published_date%3A{year}&f%5B1%5D=report_country%3A{code_countries[country]}&page={page}"
-
-            response = requests.get(URL)
-            soup = BeautifulSoup ( response.content , "html.parser" )
-
-            all_reports = soup.find_all('span',
-                                  attrs={
-                                      'class' :"file file--mime-application-pdf file--application-pdf"
-                                     }
-                                  )
-
-            all_links = [report.a.attrs['href'] for report in all_reports]
-
-            for i, link in enumerate(all_links):
-                response = requests.get("https://dtm.iom.int/" + link)
-                file_path = os.path.join(reports_dir, f"report_{country}_{i}.pdf")
-                open(file_path, "wb").write(response.content)
-                
-                # TODO: check metadata, see what we can add
-                metadata = {
-                    '/Title': f'Report_{country}_{i}',
-                    '/Country': country,
-                    '/Year': str(year)
-                }
-                
-                add_metadata_to_pdf(file_path, metadata)
-                
-                if verbose:
-                    print(f"Report #{i} saved for {country}")
-              
-        elif verbose:
-            print(f"Unknown reference to country {country} code in URL")
+    def fetch_report(task):
+        country, i = task['country'], task['idx']
+        file_path = os.path.join(reports_dir, f"report_{country}_{i}.pdf")
+        
+        # TODO: check metadata, see what we can add
+        metadata = {
+            'title': f'Report_{country}_{i}',
+            'country': country,
+            'year': task['year']
+        }
+        
+        changed = download_report(session, DTM_URL_BASE + task['url'], file_path,
+                                  scheduler, manifest, store, metadata)
+        
+        if verbose:
+            print(f"Report #{i} {'saved' if changed else 'unchanged'} for {country}")
+
+    try:
+        frontier.seed(code_countries, years)
+        frontier.run(fetch_listing, fetch_report, workers=workers, verbose=verbose)
+    finally:
+        manifest.save()
+        store.close()
+        frontier.close()
+        session.close()
 
     return reports_dir
 
-def add_metadata_to_pdf(filename, metadata):
-    #print("Adding metadata to:", filename)
-    
-    file_in = open(filename, 'ab+')
-    pdf_reader = PdfReader(file_in)
-    old_metadata = pdf_reader.metadata
-    
-    pdf_merger = PdfMerger()
-    pdf_merger.append(file_in)
-    pdf_merger.add_metadata(dict(old_metadata,**metadata))
-    pdf_merger.write(file_in)
+def _info_xref(doc):
+    """
+    Returns the xref of the document information dictionary,
+    creating an empty one if the PDF has none.
+    """
+    kind, value = doc.xref_get_key(-1, "Info")
+    if kind == "xref":
+        return int(value.split()[0])
+
+    xref = doc.get_new_xref()
+    doc.update_object(xref, "<<>>")
+    doc.xref_set_key(-1, "Info", f"{xref} 0 R")
+    return xref
 
-    file_in.close()
 
+def add_metadata_to_pdf(filename, metadata):
+    """
+    Adds metadata to the document information dictionary of a PDF.
 
-# TODO: itérer les pages et s'arrêter quand il n'y a plus de rapport
-# TODO: regarder les autres années
-# TODO: ajouter les autres pays
-# -> On s'en passe parce qu'il y a moins de 20 rapports par page, et qu'il y a qu'une seule année de rapports disponible
+    The file is saved as an incremental update: only the information
+    dictionary and a new trailer are appended, the rest of the file is
+    neither parsed nor rewritten. PDFs that cannot be updated incrementally
+    (e.g. repaired on opening) are rewritten once in a single pass.
 
+    Parameters:
+        filename (str): path of the PDF file
+        metadata (dict): PDF keys ('/Title', '/Country'...) and their values
+    """
+    doc = pymupdf.open(filename)
+    info_xref = _info_xref(doc)
+    for key, value in metadata.items():
+        doc.xref_set_key(info_xref, key.lstrip('/'), pymupdf.get_pdf_str(value))
 
+    if doc.can_save_incrementally():
+        doc.saveIncr()
+        doc.close()
+    else:
+        tmp_path = filename + ".tmp"
+        doc.save(tmp_path)
+        doc.close()
+        os.replace(tmp_path, filename)
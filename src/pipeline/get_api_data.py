@@ -6,11 +6,13 @@ from datetime import datetime
 from typing import Dict, Optional
 
 import pandas as pd
-import requests
 from newsapi import NewsApiClient
 from newspaper import Article, Config
 from newspaper.utils import BeautifulSoup
 
+from pipeline.http_scheduler import request
+from pipeline.listing_extraction import BBC_PROMO_LINKS, extract_links
+
 USER_AGENT = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:78.0) Gecko/20100101 Firefox/78.0"
 )
@@ -22,11 +24,23 @@ config.request_timeout = 30
 BBC_URL_BASE = "https://www.bbc.co.uk"
 
 
-def _get_article_text(url):
+def _download_article(url: str) -> Article:
+    """Download and parse an article, through the politeness scheduler."""
+    response = request(
+        "GET",
+        url,
+        headers={"User-Agent": USER_AGENT},
+        timeout=config.request_timeout,
+    )
+    response.raise_for_status()
     article = Article(url, config=config)
-    article.download()
+    article.download(input_html=response.text)
     article.parse()
-    return article.text
+    return article
+
+
+def _get_article_text(url):
+    return _download_article(url).text
 
 
 def _get_articles_news_api(country, start_date: datetime, end_date: datetime):
@@ -64,19 +78,20 @@ def _get_bbc_articles(country: str, nb_pages_res: int = 10) -> pd.DataFrame:
 
     # Iterate over search result pages
     for page in range(1, nb_pages_res):
-        response = requests.get(search_url + f"&page={page}")
+        response = request(
+            "GET",
+            search_url + f"&page={page}",
+            headers={"User-Agent": USER_AGENT},
+            timeout=config.request_timeout,
+        )
         if response.status_code != 200:
             break
-        soup = BeautifulSoup(response.text, "html.parser")
         # Adjust the selector based on the actual structure
-        for article in soup.find_all("a", class_="ssrcss-its5xf-PromoLink exn3ah91"):
-            base_url = article["href"]
+        for base_url in extract_links(response.content, BBC_PROMO_LINKS):
             if "news" not in base_url:
                 continue
             try:
-                article = Article(base_url, config=config)
-                article.download()
-                article.parse()
+                article = _download_article(base_url)
                 soup_article = BeautifulSoup(article.html, "html.parser")
                 bbc_dictionary = json.loads(
                     "".join(
@@ -0,0 +1,272 @@
+"""Per-host politeness scheduler shared by every HTTP call site."""
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+# Statuses meaning the host is overloaded or throttling us
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, given in seconds or as an HTTP date.
+
+    Args:
+        value (str): value of the header.
+
+    Returns:
+        float: number of seconds to wait, None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max((retry_date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class _HostState:
+    """Token bucket and adaptive concurrency limit of a single host."""
+
+    def __init__(self, rate: float, burst: float, concurrency: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.consecutive_errors = 0
+        self.condition = threading.Condition()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+
+class Slot:
+    """Permission to send one request to a host, see `HostScheduler.slot`."""
+
+    def __init__(self, scheduler: "HostScheduler", host: str):
+        self.scheduler = scheduler
+        self.host = host
+        self.started_at = time.monotonic()
+        self.recorded = False
+
+    def record(self, response: requests.Response):
+        """Feed the outcome of the request back to the scheduler.
+
+        Args:
+            response (requests.Response): response of the host.
+        """
+        self.recorded = True
+        self.scheduler._on_response(
+            self.host,
+            latency=time.monotonic() - self.started_at,
+            status_code=response.status_code,
+            retry_after=_parse_retry_after(response.headers.get("Retry-After")),
+        )
+
+    def record_error(self):
+        """Report a connection error or timeout to the scheduler."""
+        self.recorded = True
+        self.scheduler._on_response(
+            self.host,
+            latency=time.monotonic() - self.started_at,
+            status_code=None,
+            retry_after=None,
+        )
+
+
+class HostScheduler:
+    """Rate and concurrency limiter shared by every request sent to a host.
+
+    Each host gets a token bucket, refilled at `rate` requests per second,
+    and a concurrency limit adapted AIMD-style: it grows by one request per
+    window of successful requests answered within `target_latency`, and is
+    halved on slow responses, 429, 5xx or connection errors. A Retry-After
+    header (or an exponential backoff when missing) pauses the host.
+    """
+
+    def __init__(
+        self,
+        rate: float = 5.0,
+        burst: float = 5.0,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 2,
+        target_latency: float = 5.0,
+        max_backoff: float = 300.0,
+        host_rates: Optional[Dict[str, float]] = None,
+    ):
+        """Create a scheduler.
+
+        Args:
+            rate (float): requests per second allowed for each host.
+            burst (float): number of requests that can be sent at once after idling.
+            max_concurrency (int): upper bound of requests in flight per host.
+            min_concurrency (int): lower bound of requests in flight per host.
+            initial_concurrency (int): requests in flight allowed for a new host.
+            target_latency (float): response time (s) above which a host is considered overloaded.
+            max_backoff (float): longest pause (s) after consecutive errors without Retry-After.
+            host_rates (dict): rate overrides for specific hosts.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.initial_concurrency = min(max(initial_concurrency, min_concurrency), max_concurrency)
+        self.target_latency = target_latency
+        self.max_backoff = max_backoff
+        self.host_rates = host_rates or {}
+        self._hosts: Dict[str, _HostState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host: str) -> _HostState:
+        with self._lock:
+            if host not in self._hosts:
+                rate = self.host_rates.get(host, self.rate)
+                self._hosts[host] = _HostState(
+                    rate, max(self.burst, 1.0), self.initial_concurrency
+                )
+            return self._hosts[host]
+
+    def concurrency(self, host: str) -> int:
+        """Current number of requests allowed in flight for a host."""
+        return int(self._state(host).concurrency)
+
+    @contextmanager
+    def slot(self, url: str):
+        """Wait until a request to the host of `url` is allowed, and hold the slot.
+
+        Call `record` (or `record_error`) on the yielded slot once the response
+        headers are received, so the scheduler can adapt to the host.
+
+        Args:
+            url (str): URL about to be requested.
+        """
+        host = urlsplit(url).netloc
+        state = self._state(host)
+        with state.condition:
+            while True:
+                now = time.monotonic()
+                state.refill(now)
+                if now < state.blocked_until:
+                    wait = state.blocked_until - now
+                elif state.in_flight >= int(state.concurrency):
+                    wait = None
+                elif state.tokens < 1:
+                    wait = (1 - state.tokens) / state.rate
+                else:
+                    break
+                state.condition.wait(wait)
+            state.tokens -= 1
+            state.in_flight += 1
+
+        slot = Slot(self, host)
+        try:
+            yield slot
+        except (requests.ConnectionError, requests.Timeout):
+            if not slot.recorded:
+                slot.record_error()
+            raise
+        finally:
+            with state.condition:
+                state.in_flight -= 1
+                state.condition.notify_all()
+
+    def _on_response(
+        self,
+        host: str,
+        latency: float,
+        status_code: Optional[int],
+        retry_after: Optional[float],
+    ):
+        state = self._state(host)
+        with state.condition:
+            throttled = status_code is None or status_code in THROTTLE_STATUSES
+            if throttled or latency > self.target_latency:
+                # Multiplicative decrease
+                state.concurrency = max(self.min_concurrency, state.concurrency / 2)
+            else:
+                # Additive increase: +1 once per window of successful requests
+                state.concurrency = min(
+                    self.max_concurrency, state.concurrency + 1 / state.concurrency
+                )
+
+            if throttled:
+                state.consecutive_errors += 1
+                if retry_after is None:
+                    retry_after = min(self.max_backoff, 2 ** (state.consecutive_errors - 1))
+                state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+            else:
+                state.consecutive_errors = 0
+            state.condition.notify_all()
+
+
+_scheduler: Optional[HostScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> HostScheduler:
+    """Get the scheduler shared by every HTTP call site of the process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = HostScheduler()
+        return _scheduler
+
+
+def request(
+    method: str,
+    url: str,
+    session=None,
+    scheduler: Optional[HostScheduler] = None,
+    max_retries: int = 3,
+    **kwargs,
+) -> requests.Response:
+    """Send an HTTP request through the politeness scheduler.
+
+    Requests answered with 429 or 5xx, or failing to connect, are retried
+    once the scheduler allows the host again.
+
+    Args:
+        method (str): HTTP method.
+        url (str): URL to request.
+        session: requests session to send the request with. Default = requests.
+        scheduler (HostScheduler): scheduler to go through. Default = shared scheduler.
+        max_retries (int): number of retries after a throttled or failed request.
+        kwargs: arguments given to `session.request`.
+
+    Returns:
+        requests.Response: response of the last attempt.
+    """
+    session = session if session is not None else requests
+    scheduler = scheduler if scheduler is not None else get_scheduler()
+    for attempt in range(max_retries + 1):
+        last_attempt = attempt == max_retries
+        try:
+            with scheduler.slot(url) as slot:
+                response = session.request(method, url, **kwargs)
+                slot.record(response)
+        except (requests.ConnectionError, requests.Timeout):
+            if last_attempt:
+                raise
+            continue
+        if response.status_code in THROTTLE_STATUSES and not last_attempt:
+            response.close()
+            continue
+        return response
@@ -0,0 +1,71 @@
+"""Selective extraction of links from listing pages (search results, report lists)."""
+
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from lxml import etree
+
+
+class ListingSelector(NamedTuple):
+    """Declarative description of the links to extract from a listing page.
+
+    Attributes:
+        tag (str): tag of the elements holding the links.
+        classes (tuple): classes these elements must all have.
+        child (str): tag of the descendant holding the link, None if it is the element itself.
+        attribute (str): attribute holding the link.
+    """
+
+    tag: str
+    classes: Tuple[str, ...] = ()
+    child: Optional[str] = None
+    attribute: str = "href"
+
+
+DTM_REPORT_LINKS = ListingSelector(
+    tag="span",
+    classes=("file", "file--mime-application-pdf", "file--application-pdf"),
+    child="a",
+)
+
+BBC_PROMO_LINKS = ListingSelector(
+    tag="a",
+    classes=("ssrcss-its5xf-PromoLink", "exn3ah91"),
+)
+
+
+def _xpath(selector: ListingSelector) -> etree.XPath:
+    # Class tests match whole tokens of the class attribute
+    conditions = "".join(
+        f'[contains(concat(" ", normalize-space(@class), " "), " {class_name} ")]'
+        for class_name in selector.classes
+    )
+    child = f"/descendant::{selector.child}[1]" if selector.child is not None else ""
+    return etree.XPath(f"//{selector.tag}{conditions}{child}/@{selector.attribute}")
+
+
+# Compiled queries are kept per thread, as crawler workers parse pages concurrently
+_compiled = threading.local()
+
+
+def extract_links(content: Union[bytes, str], selector: ListingSelector) -> List[str]:
+    """Extract the links described by `selector` from an HTML page.
+
+    The page is parsed by lxml (libxml2) and the links are selected with an
+    XPath query compiled once per selector, so no Python object is created
+    for the elements of the page that are not links.
+
+    Args:
+        content (bytes or str): HTML of the listing page.
+        selector (ListingSelector): links to extract.
+
+    Returns:
+        list: links, in the order of the page.
+    """
+    xpaths: Dict[ListingSelector, etree.XPath] = _compiled.__dict__.setdefault("xpaths", {})
+    if selector not in xpaths:
+        xpaths[selector] = _xpath(selector)
+    root = etree.HTML(content)
+    if root is None:
+        return []
+    return [str(link) for link in xpaths[selector](root)]
@@ -6,7 +6,7 @@ import sys
 import plotly.express as px
 from environs import Env
 from pydtm import utils
-from pygeoboundaries.pygeoboundaries import get_adm
+from pygeoboundaries.pygeoboundaries import get_adm, set_scheduler
 
 import streamlit as st
 
@@ -22,6 +22,10 @@ sys.path.append(
 from utils import get_country_level_data_for_map, run_pipeline
 
 from pipeline.call_llm import get_mistral_client  # noqa: E402
+from pipeline.http_scheduler import get_scheduler  # noqa: E402
+
+# Geoboundaries and BBC requests share the same politeness scheduler
+set_scheduler(get_scheduler())
 
 env = Env()
 env.read_env(path="./src/.env")
@@ -20,6 +20,34 @@ import requests
 from requests_cache import CachedSession
 
 _session = CachedSession(expire_after=604800)  # cache expires after 1 week
+_scheduler = None
+
+
+def set_scheduler(scheduler):
+    """
+    Routes every request through a politeness scheduler (see
+    pipeline.http_scheduler.HostScheduler). Use None to disable it.
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+
+def _is_cached(url: str) -> bool:
+    # The cache key must be built like the one of the actual request,
+    # which includes verify=False
+    if not isinstance(_session, CachedSession):
+        return False
+    request = requests.Request("GET", url).prepare()
+    return _session.cache.contains(key=_session.cache.create_key(request, verify=False))
+
+
+def _get(url: str):
+    if _scheduler is None or _is_cached(url):
+        return _session.get(url, verify=False)
+    with _scheduler.slot(url) as slot:
+        response = _session.get(url, verify=False)
+        slot.record(response)
+    return response
 
 
 def clear_cache():
@@ -38,9 +66,8 @@ def disable_cache():
 
 
 def _is_valid_adm(iso3, adm: str) -> bool:
-    html = _session.get(
+    html = _get(
         "https://www.geoboundaries.org/api/current/gbOpen/{}/".format(iso3),
-        verify=False,
     ).text
     # print('adm in html =' + str(adm in html))
     return adm in html
@@ -105,9 +132,7 @@ def get_metadata(territory: str, adm: str | int) -> dict:
     Returns a json of specifided territory's metadata.
     Use adm='ALL' to get metadata for every ADM levels.
     """
-    return _session.get(
-        _generate_url(territory, adm), verify=False
-    ).json()  # TO DO get rid of verify arg
+    return _get(_generate_url(territory, adm)).json()  # TO DO get rid of verify arg
 
 
 def _get_data(territory: str, adm: str, simplified: bool) -> dict:
@@ -122,7 +147,7 @@ def _get_data(territory: str, adm: str, simplified: bool) -> dict:
             )
         )
         raise
-    return _session.get(json_uri, verify=False).text
+    return _get(json_uri).text
 
 
 def get_adm(territories: str | List[str], adm: str | int, simplified=True) -> dict: